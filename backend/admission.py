@@ -0,0 +1,156 @@
+"""入口准入控制
+
+在接口处理之前按接口所属的资源池限制同时处理的请求数。池满时请求排队等待，
+排队人数超过上限或等待超时的请求直接返回503(带Retry-After)，避免高峰期请求
+全部堆积在丰巢接口上、耗时无限增长。
+
+开箱(openBox)使用单独的资源池，列表类接口占满时开箱仍有可用的名额。
+各池的并发数和排队上限可通过环境变量 ADMISSION_<池名>=并发数:排队上限 调整，
+例如 ADMISSION_BROWSE=64:128。
+"""
+import asyncio
+import json
+import os
+from collections import deque
+
+import metrics
+
+# 接口 -> 资源池，未列出的接口(/metrics、SSE推送等)不做限制
+ENDPOINT_POOLS = {
+    "/pending_orders": "browse",
+    "/pending_orders/multi": "browse",
+    "/pending_orders/events/ticket": "browse",
+    "/completed_orders": "browse",
+    "/cabinet_location": "browse",
+    "/local_orders/sync": "browse",
+    "/completed_orders/all": "export",
+    "/openBox": "open_box",
+    "/openBox/batch": "open_box",
+    "/send_verification_code": "auth",
+    "/login": "auth",
+}
+
+# 资源池 -> (并发数, 排队上限)
+DEFAULT_POOL_LIMITS = {
+    "browse": (64, 128),
+    "export": (4, 8),
+    "open_box": (32, 256),
+    "auth": (16, 32),
+}
+
+# 排队的最长等待时间(秒)，以及503响应中建议的重试间隔(秒)
+QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "5"))
+RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "2"))
+
+
+def _pool_limits(name):
+    concurrency, max_queue = DEFAULT_POOL_LIMITS[name]
+    value = os.environ.get(f"ADMISSION_{name.upper()}")
+    if value:
+        concurrency, _, queue = value.partition(":")
+        concurrency = int(concurrency)
+        max_queue = int(queue) if queue else max_queue
+    return concurrency, max_queue
+
+
+class Pool:
+    """限制并发数的资源池，超出并发数的请求按先来先得排队"""
+
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = deque()
+
+    async def acquire(self, timeout):
+        """获取名额，成功返回None，被拒绝时返回原因(queue_full 或 timeout)"""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # 超时或取消的同时刚好分到了名额，归还给下一个等待者
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return "timeout"
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+        return None
+
+    def release(self):
+        # 有等待者时名额直接转交，active不变
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+
+class AdmissionMiddleware:
+    """按 ENDPOINT_POOLS 对请求做准入控制的ASGI中间件"""
+
+    def __init__(self, app, endpoint_pools=None, queue_timeout=None):
+        self.app = app
+        self.endpoint_pools = ENDPOINT_POOLS if endpoint_pools is None else endpoint_pools
+        self.queue_timeout = QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.pools = {
+            name: Pool(name, *_pool_limits(name)) for name in set(self.endpoint_pools.values())
+        }
+
+    async def __call__(self, scope, receive, send):
+        pool_name = self.endpoint_pools.get(scope["path"]) if scope["type"] == "http" else None
+        if pool_name is None or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        pool = self.pools[pool_name]
+        metrics.ADMISSION_QUEUED.inc(pool_name)
+        try:
+            reason = await pool.acquire(self.queue_timeout)
+        finally:
+            metrics.ADMISSION_QUEUED.dec(pool_name)
+        if reason is not None:
+            metrics.ADMISSION_REJECTED.inc(pool_name, reason)
+            await self._reject(send)
+            return
+
+        metrics.ADMISSION_ACTIVE.inc(pool_name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.ADMISSION_ACTIVE.dec(pool_name)
+            pool.release()
+
+    async def _reject(self, send):
+        body = json.dumps(
+            {"success": False, "message": "服务繁忙，请稍后重试"}, ensure_ascii=False
+        ).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(RETRY_AFTER).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -1,17 +1,172 @@
-from fastapi import FastAPI, Header, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, conlist
+from cryptography.fernet import Fernet, InvalidToken
+import asyncio
 import hashlib
+import hmac
+import json
+import math
+import os
 import base64
-from typing import Optional, Union
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5
+from collections import deque
+from itertools import groupby
+from operator import attrgetter
+from typing import List, Optional, Union
 import uvicorn
 import time
 
-app = FastAPI()
+import metrics
+import order_store
+import profiler
+import rsa_keys
+import shared_cache
+import upstream
+from admission import AdmissionMiddleware
+from cache import TTLCache
+from fast_json import OrderListResponse, TimedJSONResponse, order_response
+from frontend import FRONTEND_DIST, FrontendMiddleware
+from pending_events import PendingEventHub, TooManyPollers
+from prefetch import PagePrefetcher
+from orders import (
+    SORT_FIELDS,
+    OrderIndex,
+    OrderRecord,
+    PendingSnapshot,
+    decode_cursor,
+    group_cabinet,
+    normalize_completed_orders,
+    parse_fields,
+    to_dicts,
+)
+from structured_log import log
+from upstream import UpstreamError
+
+app = FastAPI(default_response_class=TimedJSONResponse)
+
+# 待取订单快照缓存的有效期(秒)和可缓存的token数量
+PENDING_ORDERS_CACHE_TTL = float(os.environ.get("PENDING_ORDERS_CACHE_TTL", "30"))
+PENDING_ORDERS_CACHE_SIZE = int(os.environ.get("PENDING_ORDERS_CACHE_SIZE", "1024"))
+
+# 配置了 SHARED_CACHE_PATH 时(多worker生产模式)，缓存在各worker之间共享
+pending_orders_cache = TTLCache(
+    ttl=PENDING_ORDERS_CACHE_TTL,
+    maxsize=PENDING_ORDERS_CACHE_SIZE,
+    shared=shared_cache.namespace(
+        "pending_orders", dumps=PendingSnapshot.to_json, loads=PendingSnapshot.from_json
+    ),
+)
+
+# 翻页中的待取快照的保留时间(秒)和数量；游标在这段时间内始终从签发它的快照取数
+PENDING_CURSOR_TTL = float(os.environ.get("PENDING_CURSOR_TTL", "600"))
+PENDING_CURSOR_SIZE = int(os.environ.get("PENDING_CURSOR_SIZE", "1024"))
+
+pending_cursor_snapshots = TTLCache(
+    ttl=PENDING_CURSOR_TTL,
+    maxsize=PENDING_CURSOR_SIZE,
+    shared=shared_cache.namespace(
+        "pending_cursor", dumps=PendingSnapshot.to_json, loads=PendingSnapshot.from_json
+    ),
+)
+
+# 柜机布局缓存的有效期(秒)和可缓存的柜机数量
+CABINET_CACHE_TTL = float(os.environ.get("CABINET_CACHE_TTL", "3600"))
+CABINET_CACHE_SIZE = int(os.environ.get("CABINET_CACHE_SIZE", "2048"))
+
+cabinet_cache = TTLCache(
+    ttl=CABINET_CACHE_TTL,
+    maxsize=CABINET_CACHE_SIZE,
+    shared=shared_cache.namespace(
+        "cabinet_location",
+        dumps=lambda data: json.dumps(data, ensure_ascii=False),
+        loads=json.loads,
+    ),
+)
+
+# 导出全部已取订单时每页条数和同时请求的页数
+COMPLETED_EXPORT_PAGE_SIZE = int(os.environ.get("COMPLETED_EXPORT_PAGE_SIZE", "50"))
+COMPLETED_EXPORT_MAX_PAGE_SIZE = 100
+COMPLETED_EXPORT_CONCURRENCY = int(os.environ.get("COMPLETED_EXPORT_CONCURRENCY", "4"))
+COMPLETED_EXPORT_MAX_CONCURRENCY = 16
+
+# 带筛选或排序条件查询已取订单时，全部已取订单及其索引的缓存有效期(秒)和可缓存的token数
+COMPLETED_INDEX_TTL = float(os.environ.get("COMPLETED_INDEX_TTL", "60"))
+COMPLETED_INDEX_SIZE = int(os.environ.get("COMPLETED_INDEX_SIZE", "64"))
+# 建立索引时最多请求的页数(每页 COMPLETED_EXPORT_MAX_PAGE_SIZE 条)，超出部分不参与筛选
+COMPLETED_INDEX_MAX_PAGES = int(os.environ.get("COMPLETED_INDEX_MAX_PAGES", "20"))
+
+completed_index_cache = TTLCache(ttl=COMPLETED_INDEX_TTL, maxsize=COMPLETED_INDEX_SIZE)
+
+# 登录握手参数(发送验证码时获得的公钥和校验参数)的保留时间(秒)和最多保留的手机号数量
+LOGIN_HANDSHAKE_TTL = float(os.environ.get("LOGIN_HANDSHAKE_TTL", "600"))
+LOGIN_HANDSHAKE_SIZE = int(os.environ.get("LOGIN_HANDSHAKE_SIZE", "10000"))
+
+
+def _dump_handshake(handshake):
+    # 已解析的密钥对象不能序列化，其他worker读取后从公钥缓存中重新获取
+    return json.dumps({k: v for k, v in handshake.items() if k != "key"}, ensure_ascii=False)
+
+
+login_handshakes = TTLCache(
+    ttl=LOGIN_HANDSHAKE_TTL,
+    maxsize=LOGIN_HANDSHAKE_SIZE,
+    shared=shared_cache.namespace("login_handshake", dumps=_dump_handshake, loads=json.loads),
+)
+
+# 已取订单预读下一页的暂存时间(秒，0表示关闭预读)和最多暂存的token数量
+COMPLETED_PREFETCH_TTL = float(os.environ.get("COMPLETED_PREFETCH_TTL", "30"))
+COMPLETED_PREFETCH_SIZE = int(os.environ.get("COMPLETED_PREFETCH_SIZE", "256"))
+
+# 批量开箱时单个包裹的超时时间(秒)
+OPEN_BOX_ITEM_TIMEOUT = float(os.environ.get("OPEN_BOX_ITEM_TIMEOUT", "20"))
+OPEN_BOX_MAX_ITEM_TIMEOUT = 60.0
+# 一次批量开箱最多包含的包裹数；整批只占一个 open_box 准入名额，必须限制大小
+OPEN_BOX_BATCH_MAX_ITEMS = int(os.environ.get("OPEN_BOX_BATCH_MAX_ITEMS", "20"))
+
+# 多账号查询时所有请求共享的上游并发上限，以及单个账号的默认超时时间(秒)
+MULTI_ACCOUNT_CONCURRENCY = int(os.environ.get("MULTI_ACCOUNT_CONCURRENCY", "20"))
+MULTI_ACCOUNT_DEADLINE = float(os.environ.get("MULTI_ACCOUNT_DEADLINE", "10"))
+MULTI_ACCOUNT_MAX_DEADLINE = 30.0
+_multi_account_semaphore = None
+
+# SSE推送的心跳间隔(秒)，防止代理因连接空闲而断开
+PENDING_EVENTS_HEARTBEAT = 15.0
+# 建立推送连接用的一次性票据的有效期(秒)
+PENDING_EVENTS_TICKET_TTL = int(os.environ.get("PENDING_EVENTS_TICKET_TTL", "30"))
+PENDING_EVENTS_TICKET_SIZE = 10000
+# 加密票据的密钥，未配置时每个进程随机生成；多worker时由 serve.py 生成后传给各worker
+PENDING_EVENTS_TICKET_SECRET = os.environ.get("PENDING_EVENTS_TICKET_SECRET", "")
+
+
+def _ticket_cipher(secret):
+    if not secret:
+        return Fernet(Fernet.generate_key())
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+
+
+# EventSource无法设置请求头，票据是加密后的Authorization(带签发时间)，
+# 任何worker都能解开，服务端不保存token
+pending_event_ticket_cipher = _ticket_cipher(PENDING_EVENTS_TICKET_SECRET)
+
+# 已使用过的票据，保证每张票据只能用一次(键在共享存储中哈希保存，值不含token)
+used_event_tickets = TTLCache(
+    ttl=PENDING_EVENTS_TICKET_TTL,
+    maxsize=PENDING_EVENTS_TICKET_SIZE,
+    shared=shared_cache.namespace(
+        "pending_events_ticket_used", dumps=json.dumps, loads=json.loads
+    ),
+)
 
+# 性能剖析接口的访问令牌，未配置时该接口不可用；单次剖析的最长时间(秒)
+PROFILER_TOKEN = os.environ.get("PROFILER_TOKEN", "")
+PROFILE_MAX_SECONDS = 60.0
+
+# 本地订单库增量同步时每次请求的条数
+ORDER_SYNC_PAGE_SIZE = int(os.environ.get("ORDER_SYNC_PAGE_SIZE", "50"))
+
+# 准入控制放在CORS之内，503响应也带有CORS头
+app.add_middleware(AdmissionMiddleware)
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -20,6 +175,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+# 配置了 FRONTEND_DIST 时同时托管前端页面，接口也可以通过 /api 前缀同源访问
+if FRONTEND_DIST:
+    app.add_middleware(FrontendMiddleware, directory=FRONTEND_DIST, routes=app.routes)
+
+
+@app.on_event("startup")
+async def startup_event():
+    log.start()
+    await upstream.startup()
+    await order_store.startup()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 先停止后台轮询和预读，避免它们在关闭期间重新创建上游连接
+    pending_event_hub.close()
+    completed_prefetcher.clear()
+    await upstream.shutdown()
+    await order_store.shutdown()
+    rsa_keys.shutdown()
+    shared_cache.shutdown()
+    log.stop()
 
 
 class VerificationRequest(BaseModel):
@@ -31,10 +209,11 @@ class VerificationRequest(BaseModel):
 class LoginRequest(BaseModel):
     phoneNumber: str
     verificationCode: str
-    rsaPublicKey: str
-    clientIp: str
-    requestCode: str
-    timestamp: Union[str, int]  # 允许字符串或整数类型
+    # 以下握手参数已保存在服务端，只为兼容旧版前端保留
+    rsaPublicKey: Optional[str] = None
+    clientIp: Optional[str] = None
+    requestCode: Optional[str] = None
+    timestamp: Optional[Union[str, int]] = None  # 允许字符串或整数类型
 
 
 class CabinetLocationRequest(BaseModel):
@@ -58,52 +237,20 @@ class OpenBoxRequest(BaseModel):
     address: str
 
 
-def format_rsa_key(key_data):
-    """格式化RSA密钥为PEM格式"""
-    # 去除可能的头尾部分
-    key_data = key_data.strip()
-
-    # 如果已经是PEM格式，直接返回
-    if key_data.startswith("-----BEGIN"):
-        return key_data
+class AccountToken(BaseModel):
+    authorization: str
+    label: Optional[str] = None  # 用于标记订单所属账号，如手机号
 
-    # 否则添加PEM头尾
-    return f"-----BEGIN PUBLIC KEY-----\n{key_data}\n-----END PUBLIC KEY-----"
 
+class MultiAccountPendingRequest(BaseModel):
+    accounts: List[AccountToken]
+    deadline: Optional[float] = None  # 单个账号的超时时间(秒)
+    refresh: bool = False
 
-def encrypt_with_rsa(data, key_string):
-    """使用RSA公钥加密数据"""
-    try:
-        # 尝试标准PEM格式导入
-        key = RSA.importKey(key_string)
-    except ValueError:
-        try:
-            # 尝试格式化后再导入
-            formatted_key = format_rsa_key(key_string)
-            key = RSA.importKey(formatted_key)
-        except Exception as e:
-            # 如果还是失败，尝试直接使用base64解码的数据加密
-            # 这是一个备选方案，因为原始代码可能使用了特殊方式处理公钥
-            from cryptography.hazmat.primitives.asymmetric import padding
-            from cryptography.hazmat.primitives import serialization
-            from cryptography.hazmat.backends import default_backend
-
-            try:
-                # 尝试使用cryptography库
-                key_bytes = base64.b64decode(key_string)
-                public_key = serialization.load_der_public_key(
-                    key_bytes, backend=default_backend()
-                )
-                encrypted = public_key.encrypt(data.encode(), padding.PKCS1v15())
-                return encrypted
-            except Exception:
-                # 如果所有尝试都失败，记录详细错误并重新抛出原始异常
-                print(f"无法解析RSA公钥: {key_string[:30]}...")
-                raise e
 
-    # 使用PKCS1_v1_5进行加密
-    cipher = PKCS1_v1_5.new(key)
-    return cipher.encrypt(data.encode())
+class BatchOpenBoxRequest(BaseModel):
+    items: conlist(OpenBoxRequest, max_items=OPEN_BOX_BATCH_MAX_ITEMS)
+    timeout: Optional[float] = None  # 单个包裹的开箱超时(秒)
 
 
 @app.post("/send_verification_code")
@@ -111,7 +258,7 @@ async def send_verification_code(request: VerificationRequest):
     phone_number = request.phoneNumber
 
     # 第一步: 获取校验参数
-    url = f"https://consumer.fcbox.com/v1/account/secureCheckMobile?mobile={phone_number}&type=11&opCode=30b2718363204beeae98b7d03a75c3a4&nationCode=86"
+    url = f"{upstream.FCBOX_BASE_URL}/v1/account/secureCheckMobile?mobile={phone_number}&type=11&opCode=30b2718363204beeae98b7d03a75c3a4&nationCode=86"
     headers = {
         "pinpoint-traceid": "ConsumerA^1742830234658^73",
         "User-Agent": "channel=xiaomi,ip=,os=15,deviceType=2211133C,platform=Android,resolution=1080*2296,versionCode=6007000,versionName=6.7.0,timestamp=1742830229382",
@@ -124,11 +271,10 @@ async def send_verification_code(request: VerificationRequest):
         "Connection": "Keep-Alive",
     }
 
-    response = requests.get(url, headers=headers)
-    result = response.json()
+    response = await upstream.get(url, headers=headers)
+    result = upstream.decode_json(response)
 
-    # 打印关键信息用于调试
-    print(f"获取到的响应: {result}")
+    log.debug("send_code.check_response", phoneNumber=phone_number, response=result)
 
     # 提取参数
     key_order = result["data"]["keyOrder"].split(",")
@@ -136,8 +282,6 @@ async def send_verification_code(request: VerificationRequest):
     for i in range(1, 6):
         rsa_public_key += result["data"][f"key{key_order[i - 1]}"]
 
-    print(f"构建的RSA公钥: {rsa_public_key[:30]}...")
-
     client_ip = result["data"]["clientIp"]
     request_code = result["data"]["requestCode"]
     timestamp = result["data"]["timestamp"]
@@ -154,19 +298,18 @@ async def send_verification_code(request: VerificationRequest):
 
     sign = f"86{phone_number}{hashlib.md5(md5_text.encode()).hexdigest()}"
 
-    print(f"需要加密的签名: {sign}")
-
-    # RSA加密和Base64编码 - 使用改进的加密函数
+    # RSA加密和Base64编码，解析后的公钥随握手参数保存，登录时直接使用
     try:
-        encrypted = encrypt_with_rsa(sign, rsa_public_key)
+        key = await rsa_keys.load_rsa_key_async(rsa_public_key)
+        encrypted = await rsa_keys.encrypt_with_key_async(sign, *key)
         sign_encoded = base64.b64encode(encrypted).decode()
     except Exception as e:
-        print(f"加密过程中出错: {str(e)}")
+        log.error("send_code.encrypt_failed", phoneNumber=phone_number, error=str(e))
         # 失败时返回错误信息
         return {"success": False, "error": f"加密失败: {str(e)}", "data": result}
 
     # 第三步: 发送验证码
-    verify_url = f"https://consumer.fcbox.com/v1/account/secureSendCode?mobile={phone_number}&type=11&opCode=30b2718363204beeae98b7d03a75c3a4&nationCode=86&sliderTicket={slider_ticket}&sliderRandstr={slider_randstr}&sign={sign_encoded}"
+    verify_url = f"{upstream.FCBOX_BASE_URL}/v1/account/secureSendCode?mobile={phone_number}&type=11&opCode=30b2718363204beeae98b7d03a75c3a4&nationCode=86&sliderTicket={slider_ticket}&sliderRandstr={slider_randstr}&sign={sign_encoded}"
 
     verify_headers = {
         "pinpoint-traceid": "ConsumerA^1742830234824^83",
@@ -181,11 +324,22 @@ async def send_verification_code(request: VerificationRequest):
         "Connection": "Keep-Alive",
     }
 
-    verify_response = requests.post(verify_url, headers=verify_headers)
+    verify_response = await upstream.post(verify_url, headers=verify_headers)
+
+    login_handshakes.set(
+        phone_number,
+        {
+            "rsa_public_key": rsa_public_key,
+            "client_ip": client_ip,
+            "request_code": request_code,
+            "timestamp": timestamp,
+            "key": key,
+        },
+    )
 
     return {
         "success": True,
-        "data": verify_response.json(),
+        "data": upstream.decode_json(verify_response),
         "params": {
             "rsa_public_key": rsa_public_key,
             "client_ip": client_ip,
@@ -199,31 +353,43 @@ async def send_verification_code(request: VerificationRequest):
 async def login(request: LoginRequest):
     phone_number = request.phoneNumber
     verification_code = request.verificationCode
-    rsa_public_key = request.rsaPublicKey
-    client_ip = request.clientIp
-    request_code = request.requestCode
-    timestamp = str(request.timestamp)  # 确保timestamp是字符串类型
 
-    print(
-        f"登录参数 - 手机号: {phone_number}, 验证码: {verification_code}, 时间戳: {timestamp}"
-    )
+    # 优先使用发送验证码时保存的握手参数，旧版前端会把参数一并传回
+    handshake = login_handshakes.get(phone_number)
+    if handshake is None and request.rsaPublicKey and request.timestamp is not None:
+        handshake = {
+            "rsa_public_key": request.rsaPublicKey,
+            "client_ip": request.clientIp or "",
+            "request_code": request.requestCode or "",
+            "timestamp": request.timestamp,
+        }
+    if handshake is None:
+        return {"success": False, "error": "验证参数已过期，请重新获取验证码"}
+
+    client_ip = handshake["client_ip"]
+    request_code = handshake["request_code"]
+    timestamp = str(handshake["timestamp"])  # 确保timestamp是字符串类型
+
+    log.info("login.start", phoneNumber=phone_number, timestamp=timestamp)
 
     # 准备签名
     md5_text = f"86{phone_number}{verification_code}01{timestamp}{client_ip}{request_code}30b2718363204beeae98b7d03a75c3a4"
     sign = f"86{phone_number}{hashlib.md5(md5_text.encode()).hexdigest()}"
 
-    print(f"登录签名: {sign}")
-
-    # RSA加密和Base64编码 - 使用改进的加密函数
+    # RSA加密和Base64编码，握手参数来自其他worker或旧版前端时才需要获取公钥
     try:
-        encrypted = encrypt_with_rsa(sign, rsa_public_key)
+        key = handshake.get("key")
+        if key is None:
+            encrypted = await rsa_keys.encrypt_with_rsa_async(sign, handshake["rsa_public_key"])
+        else:
+            encrypted = await rsa_keys.encrypt_with_key_async(sign, *key)
         sign_encoded = base64.b64encode(encrypted).decode()
     except Exception as e:
-        print(f"登录加密过程中出错: {str(e)}")
+        log.error("login.encrypt_failed", phoneNumber=phone_number, error=str(e))
         return {"success": False, "error": f"登录加密失败: {str(e)}"}
 
     # 登录请求
-    url = f"https://consumer.fcbox.com/v1/account/secureLoginByPhone?mobile={phone_number}&verifyCode={verification_code}&channel=0&type=1&weiXinUser=&nationCode=86&opCode=30b2718363204beeae98b7d03a75c3a4&sign={sign_encoded}"
+    url = f"{upstream.FCBOX_BASE_URL}/v1/account/secureLoginByPhone?mobile={phone_number}&verifyCode={verification_code}&channel=0&type=1&weiXinUser=&nationCode=86&opCode=30b2718363204beeae98b7d03a75c3a4&sign={sign_encoded}"
 
     headers = {
         "pinpoint-traceid": "ConsumerA^1742830241164^93",
@@ -238,19 +404,20 @@ async def login(request: LoginRequest):
         "Connection": "Keep-Alive",
     }
 
-    response = requests.post(url, headers=headers)
+    response = await upstream.post(url, headers=headers)
     authorization = response.headers.get("Authorization", "")
 
-    # 打印响应信息
-    print(f"登录响应状态码: {response.status_code}")
-    print(f"登录响应头: {dict(response.headers)}")
+    log.info("login.response", phoneNumber=phone_number, status=response.status_code)
+
+    if authorization:
+        # 握手参数只能用于一次成功的登录
+        login_handshakes.invalidate(phone_number)
 
     try:
-        response_data = response.json()
-        print(f"登录响应数据: {response_data}")
+        response_data = upstream.decode_json(response)
+        log.debug("login.response_body", headers=response.headers, body=response_data)
     except Exception as e:
-        print(f"解析响应JSON失败: {str(e)}")
-        print(f"原始响应内容: {response.text[:200]}")
+        log.warning("login.invalid_json", error=str(e), body=response.text)
 
     return {
         "success": True,
@@ -259,16 +426,25 @@ async def login(request: LoginRequest):
     }
 
 
-@app.get("/completed_orders")
-async def get_completed_orders(
-    authorization: str = Header(None), page: int = 1, limit: int = 10
-):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header is required")
+async def save_to_order_store(authorization, orders, pending=False):
+    """把订单写入本地订单库(未启用时忽略)，写入失败不影响接口返回"""
+    store = order_store.get_store()
+    if store is None:
+        return
+    try:
+        account = order_store.account_key(authorization)
+        if pending:
+            await store.replace_pending(account, orders)
+        else:
+            await store.upsert_orders(account, orders)
+    except Exception as e:
+        log.error("order_store.write_failed", error=str(e))
 
-    url = "https://consumer.fcbox.com/post/express/pageQuery4App"
 
-    # 使用前端传递的page和limit参数
+async def fetch_completed_page(authorization, page, limit):
+    """请求pageQuery4App的一页已取订单，返回 (规范化后的订单列表, 总数)"""
+    url = f"{upstream.FCBOX_BASE_URL}/post/express/pageQuery4App"
+
     data = {"expressStatus": "2", "pageNo": str(page), "pageSize": str(limit)}
 
     headers = {
@@ -283,107 +459,294 @@ async def get_completed_orders(
     }
 
     try:
-        response = requests.post(url, data=data, headers=headers)
+        response = await upstream.post(url, data=data, headers=headers)
+    except Exception as e:
+        log.warning("completed_orders.request_failed", page=page, error=str(e))
+        raise UpstreamError(f"API请求异常: {str(e)}")
+
+    # 检查响应状态码
+    if response.status_code != 200:
+        log.warning("completed_orders.bad_status", page=page, status=response.status_code)
+        raise UpstreamError(f"API返回状态码: {response.status_code}")
+
+    # 检查响应内容是否为空
+    if not response.text:
+        log.warning("completed_orders.empty_response", page=page)
+        raise UpstreamError("API返回空响应")
+
+    # 尝试解析JSON
+    try:
+        response_data = upstream.decode_json(response)
+    except Exception as e:
+        log.warning("completed_orders.invalid_json", page=page, error=str(e))
+        raise UpstreamError(f"返回数据解析失败: {str(e)}")
 
-        # 检查响应状态码
-        if response.status_code != 200:
-            print(f"已取件API返回非200状态码: {response.status_code}")
-            return {
-                "success": False,
-                "data": [],
-                "message": f"API返回状态码: {response.status_code}",
-                "page": page,
-                "pageSize": limit,
-            }
+    # 规范化已取订单数据结构，与待取订单保持一致
+    with metrics.phase("normalize"):
+        orders = normalize_completed_orders(response_data)
+    total = (response_data.get("data") or {}).get("total", len(orders))
+    return orders, total
+
+
+completed_prefetcher = PagePrefetcher(
+    fetch=fetch_completed_page, ttl=COMPLETED_PREFETCH_TTL, maxsize=COMPLETED_PREFETCH_SIZE
+)
+
+
+async def fetch_completed_index(authorization):
+    """取全部已取订单并建立索引，返回 (OrderIndex, 是否不完整, 是否有请求失败)
+
+    本地订单库已完整同步过该账号时，先做一次增量同步再从库中读取；否则从丰巢
+    并发请求，最多 COMPLETED_INDEX_MAX_PAGES 页。超过页数上限、个别页面请求
+    失败或增量同步失败时，用已取到的订单建立索引并标记为不完整。
+    """
+    store = order_store.get_store()
+    if store is not None:
+        account = order_store.account_key(authorization)
+        if await store.sync_watermark(account) is not None:
+            failed = False
+            try:
+                await sync_completed_orders(authorization)
+            except UpstreamError as e:
+                log.warning("completed_index.sync_failed", error=str(e))
+                failed = True
+            data, total = await store.query(
+                account,
+                order_store.STATUS_COMPLETED,
+                limit=COMPLETED_INDEX_MAX_PAGES * COMPLETED_EXPORT_MAX_PAGE_SIZE,
+            )
+            with metrics.phase("normalize"):
+                index = OrderIndex([OrderRecord(**order) for order in data])
+            return index, failed or total > len(data), failed
+
+    page_size = COMPLETED_EXPORT_MAX_PAGE_SIZE
+    orders, total = await fetch_completed_page(authorization, 1, page_size)
+    try:
+        total = int(total)
+    except (TypeError, ValueError):
+        total = len(orders)
+    pages = max(1, math.ceil(total / page_size))
+    capped = pages > COMPLETED_INDEX_MAX_PAGES
+    pages = min(pages, COMPLETED_INDEX_MAX_PAGES)
+    failed = False
+
+    semaphore = asyncio.Semaphore(COMPLETED_EXPORT_CONCURRENCY)
+
+    async def fetch_page(page):
+        async with semaphore:
+            page_orders, _ = await fetch_completed_page(authorization, page, page_size)
+            return page_orders
+
+    results = await asyncio.gather(
+        *(fetch_page(p) for p in range(2, pages + 1)), return_exceptions=True
+    )
+    for page, result in enumerate(results, start=2):
+        if isinstance(result, UpstreamError):
+            log.warning("completed_index.page_failed", page=page, error=str(result))
+            failed = True
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            orders.extend(result)
+
+    await save_to_order_store(authorization, orders)
+    with metrics.phase("normalize"):
+        return OrderIndex(orders), capped or failed, failed
+
+
+def order_filters(companyName, boxName, cabinetCode, pickStatus, custodyFee, sort):
+    """整理订单列表的筛选和排序参数，没有任何条件时返回None
+
+    返回 OrderIndex.select 的关键字参数(desc 由调用方补充)。
+    cabinetCode 与 boxName 含义相同(订单的boxName即柜机编号)。
+    """
+    if sort is not None and sort not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail="sort must be sendTm or pickTm")
+    filters = {
+        "companyName": companyName,
+        "boxName": boxName or cabinetCode,
+        "pickStatus": pickStatus,
+    }
+    if sort is None and custodyFee is None and all(value is None for value in filters.values()):
+        return None
+    return {"filters": filters, "custody_fee": custodyFee, "sort": sort}
 
-        # 检查响应内容是否为空
-        if not response.text:
-            print("已取件API返回空响应")
-            return {
-                "success": False,
-                "data": [],
-                "message": "API返回空响应",
-                "page": page,
-                "pageSize": limit,
-            }
 
-        # 尝试解析JSON
+@app.get("/completed_orders", response_class=OrderListResponse)
+async def get_completed_orders(
+    http_request: Request,
+    authorization: str = Header(None),
+    page: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1),
+    fields: Optional[str] = None,
+    companyName: Optional[str] = None,
+    boxName: Optional[str] = None,
+    cabinetCode: Optional[str] = None,
+    pickStatus: Optional[str] = None,
+    custodyFee: Optional[bool] = None,
+    sort: Optional[str] = None,
+    desc: bool = True,
+):
+    """已取订单
+
+    带上 companyName / boxName(cabinetCode) / pickStatus / custodyFee 筛选条件或
+    sort(sendTm、pickTm，desc=false 为升序)时，改为在全部已取订单的索引上查询，
+    只返回符合条件的当前页，total 为符合条件的总数；partial 为true时表示只在
+    部分已取订单中查询(超过页数上限或部分页面请求失败)。
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is required")
+
+    query = order_filters(companyName, boxName, cabinetCode, pickStatus, custodyFee, sort)
+    if query is not None:
         try:
-            response_data = response.json()
-        except Exception as e:
-            print(f"已取件API返回的JSON无法解析: {str(e)}")
+            index, partial, failed = await completed_index_cache.get_or_load(
+                authorization, lambda: fetch_completed_index(authorization)
+            )
+        except UpstreamError as e:
             return {
                 "success": False,
                 "data": [],
-                "message": f"返回数据解析失败: {str(e)}",
+                "message": str(e),
                 "page": page,
                 "pageSize": limit,
             }
-    except Exception as e:
-        print(f"已取件API请求异常: {str(e)}")
+        if failed:
+            # 有请求失败的结果只用于本次请求，下次重新获取；只因页数上限而不完整的照常缓存
+            completed_index_cache.invalidate(authorization)
+        rows = index.select(**query, descending=desc)
+        start_idx = (page - 1) * limit
+        return order_response(
+            {
+                "success": True,
+                "data": to_dicts(
+                    index.take(rows[start_idx : start_idx + limit]), parse_fields(fields)
+                ),
+                "page": page,
+                "pageSize": limit,
+                "total": len(rows),
+                "partial": partial,
+            },
+            http_request,
+        )
+
+    # 使用前端传递的page和limit参数，上一页已预读时直接使用预读结果
+    try:
+        orders, total = await completed_prefetcher.get(authorization, page, limit)
+    except UpstreamError as e:
         return {
             "success": False,
             "data": [],
-            "message": f"API请求异常: {str(e)}",
+            "message": str(e),
             "page": page,
             "pageSize": limit,
         }
 
-    orders = []
-    if response_data.get("success") and response_data.get("data"):
-        # 尝试从不同可能的路径中获取订单数据
-        raw_orders = []
-        if "expressInfoDtos" in response_data["data"]:
-            raw_orders = response_data["data"]["expressInfoDtos"]
-        elif "data" in response_data["data"]:
-            raw_orders = response_data["data"]["data"]
-
-        # 规范化已取订单数据结构，与待取订单保持一致
-        for order in raw_orders:
-            normalized_order = {
-                "expressId": order.get("expressId", ""),
-                "companyName": order.get("companyName", "未知快递"),
-                "courierName": order.get("companyName", "未知"),
-                "pickupCode": order.get("code", ""),
-                "boxNo": order.get("boxId", ""),
-                "boxName": order.get("cabinetCode", ""),
-                "boxLocation": order.get("boxLocation", ""),
-                "address": order.get("address", ""),
-                "sendTm": order.get("sendTm", ""),
-                "pickTm": order.get("pickTm", ""),
-                "clientMobile": order.get("clientMobile", order.get("pickerPhone", "")),
-                "pickStatus": order.get("pickStatus", ""),
-                "pickStatusDesc": order.get("pickStatusDesc", "已取件"),
-                "expressStatus": "2",  # 2表示已取件
-                "postId": order.get("postId", ""),
-                "companyLogoUrl": order.get("companyLogoUrl", ""),
-                "staffMobile": order.get("staffMobile", ""),
-                "totalCustodyFee": order.get("totalCustodyFee", "0"),
-                "custodyFeeTag": order.get("custodyFeeInfo", "").get(
-                    "custodyFeeTag", ""
-                ),
-            }
-            orders.append(normalized_order)
+    # 后面还有数据时预读下一页
+    if isinstance(total, int) and page * limit < total:
+        completed_prefetcher.schedule(authorization, page + 1, limit)
+
+    await save_to_order_store(authorization, orders)
 
     # 规范化返回格式，直接返回数组
-    return {
-        "success": True,
-        "data": orders,
-        "page": page,
-        "pageSize": limit,
-        "total": response_data.get("data", {}).get("total", len(orders)),
-    }
+    return order_response(
+        {
+            "success": True,
+            "data": to_dicts(orders, parse_fields(fields)),
+            "page": page,
+            "pageSize": limit,
+            "total": total,
+        },
+        http_request,
+    )
 
 
-@app.get("/pending_orders")
-async def get_pending_orders(
-    authorization: str = Header(None), page: int = 1, limit: int = 10
+@app.get("/completed_orders/all")
+async def export_completed_orders(
+    authorization: str = Header(None),
+    page_size: int = COMPLETED_EXPORT_PAGE_SIZE,
+    concurrency: int = COMPLETED_EXPORT_CONCURRENCY,
 ):
+    """以NDJSON流的形式导出全部已取订单
+
+    先请求第一页拿到total，再按并发上限同时请求后续页面，按页码顺序逐行输出:
+    {"type": "meta", ...} 一行，随后每个订单一行 {"type": "order", "seq": n, ...}，
+    某页失败时输出 {"type": "error", "page": p, ...}，最后以 {"type": "end", ...} 结束。
+    """
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header is required")
 
-    # 待取件接口，暂无分页功能，但仍然接收参数以保持API一致性
-    url = "https://consumer.fcbox.com/post/mobilePick/queryWaitPick?channelCode=ANDROID_FC_APP"
+    page_size = max(1, min(page_size, COMPLETED_EXPORT_MAX_PAGE_SIZE))
+    concurrency = max(1, min(concurrency, COMPLETED_EXPORT_MAX_CONCURRENCY))
+
+    # 第一页单独请求，失败时还能返回普通的错误响应
+    try:
+        first_orders, total = await fetch_completed_page(authorization, 1, page_size)
+    except UpstreamError as e:
+        return {"success": False, "data": [], "message": str(e)}
+
+    try:
+        total = int(total)
+    except (TypeError, ValueError):
+        total = len(first_orders)
+    pages = max(1, math.ceil(total / page_size))
+
+    async def generate():
+        seq = 0
+
+        def lines(page, orders):
+            nonlocal seq
+            for order in orders:
+                seq += 1
+                yield json.dumps(
+                    {"type": "order", "seq": seq, "page": page, "data": order.to_dict()},
+                    ensure_ascii=False,
+                ) + "\n"
+
+        yield json.dumps(
+            {"type": "meta", "total": total, "pages": pages, "pageSize": page_size},
+            ensure_ascii=False,
+        ) + "\n"
+        for line in lines(1, first_orders):
+            yield line
+
+        # 滑动窗口: 最多同时有concurrency个页面在请求中，既限制对上游的并发，
+        # 也限制了等待按序输出的页面所占的内存
+        window = deque()
+        next_page = 2
+        try:
+            while window or next_page <= pages:
+                while next_page <= pages and len(window) < concurrency:
+                    task = asyncio.ensure_future(
+                        fetch_completed_page(authorization, next_page, page_size)
+                    )
+                    window.append((next_page, task))
+                    next_page += 1
+
+                page, task = window.popleft()
+                try:
+                    orders, _ = await task
+                except UpstreamError as e:
+                    yield json.dumps(
+                        {"type": "error", "page": page, "message": str(e)},
+                        ensure_ascii=False,
+                    ) + "\n"
+                    continue
+                for line in lines(page, orders):
+                    yield line
+        finally:
+            # 客户端断开时取消尚未完成的页面请求
+            for _, task in window:
+                task.cancel()
+
+        yield json.dumps({"type": "end", "count": seq}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def fetch_pending_orders(authorization):
+    """请求queryWaitPick并返回待取快照(PendingSnapshot)"""
+    url = f"{upstream.FCBOX_BASE_URL}/post/mobilePick/queryWaitPick?channelCode=ANDROID_FC_APP"
 
     headers = {
         "pinpoint-traceid": "ConsumerA0fc2d4fc6bfea8b^1742843515003^1713",
@@ -399,143 +762,340 @@ async def get_pending_orders(
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = await upstream.get(url, headers=headers)
+    except Exception as e:
+        raise UpstreamError(f"API请求异常: {str(e)}")
+
+    # 检查响应状态码
+    if response.status_code != 200:
+        log.warning("pending_orders.bad_status", status=response.status_code)
+        raise UpstreamError(f"API返回状态码: {response.status_code}")
+
+    # 检查响应内容是否为空
+    if not response.text:
+        log.warning("pending_orders.empty_response")
+        raise UpstreamError("API返回空响应")
+
+    # 尝试解析JSON
+    try:
+        response_data = upstream.decode_json(response)
+    except Exception as e:
+        raise UpstreamError(f"API请求异常: {str(e)}")
+
+    log.debug("pending_orders.upstream_response", response=response_data)
+
+    # 保留柜机 -> 箱子 -> 包裹的层级，包裹在取用时才规范化
+    snapshot = PendingSnapshot(response_data)
+
+    if order_store.get_store() is not None:
+        try:
+            with metrics.phase("normalize"):
+                records = snapshot.records
+        except Exception as e:
+            raise UpstreamError(f"API请求异常: {str(e)}")
+        await save_to_order_store(authorization, records, pending=True)
+    return snapshot
 
-        # 打印响应状态和内容
-        print(f"待取件API响应状态码: {response.status_code}")
-        print(f"待取件API响应内容前200个字符: {response.text[:200]}")
 
-        # 检查响应状态码
-        if response.status_code != 200:
-            print(f"待取件API返回非200状态码: {response.status_code}")
+@app.get("/pending_orders", response_class=OrderListResponse)
+async def get_pending_orders(
+    http_request: Request,
+    authorization: str = Header(None),
+    page: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1),
+    refresh: bool = False,
+    fields: Optional[str] = None,
+    shape: str = "flat",
+    cursor: Optional[str] = None,
+    companyName: Optional[str] = None,
+    boxName: Optional[str] = None,
+    cabinetCode: Optional[str] = None,
+    pickStatus: Optional[str] = None,
+    custodyFee: Optional[bool] = None,
+    sort: Optional[str] = None,
+    desc: bool = True,
+):
+    """待取订单
+
+    shape=flat(默认)按包裹分页；shape=grouped 保留 柜机 -> 箱子 -> 包裹 的层级，
+    柜机地址、箱子位置只输出一次，page/limit 按柜机分页。
+    flat模式下返回 nextCursor，带上 cursor 请求下一页时忽略 page；后续页面从签发
+    游标的快照中取，翻页期间有包裹被取走也不会跳过或重复，游标过期后返回400。
+    companyName / boxName(cabinetCode) / pickStatus / custodyFee 筛选和 sort 排序
+    在快照的索引上完成，按 page/limit 分页并返回符合条件的 total；
+    此时不支持 cursor，grouped 模式不支持排序。
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is required")
+    if shape not in ("flat", "grouped"):
+        raise HTTPException(status_code=400, detail="shape must be flat or grouped")
+    query = order_filters(companyName, boxName, cabinetCode, pickStatus, custodyFee, sort)
+    if query is not None and cursor:
+        raise HTTPException(
+            status_code=400, detail="cursor cannot be combined with filters or sort"
+        )
+    if query is not None and shape == "grouped" and sort is not None:
+        raise HTTPException(status_code=400, detail="grouped shape cannot be sorted")
+    position = None
+    snapshot = None
+    if cursor:
+        try:
+            version, position = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+        snapshot = pending_cursor_snapshots.get((authorization, version))
+        if snapshot is None:
+            raise HTTPException(status_code=400, detail="cursor expired")
+
+    # 待取件接口上游无分页，整份快照按token缓存，翻页时只规范化当前页的包裹
+    # refresh=true 时跳过缓存重新拉取(前端下拉刷新使用)
+    if snapshot is None:
+        try:
+            snapshot = await pending_orders_cache.get_or_load(
+                authorization,
+                lambda: fetch_pending_orders(authorization),
+                refresh=refresh,
+            )
+        except UpstreamError as e:
             return {
                 "success": False,
                 "data": [],
-                "message": f"API返回状态码: {response.status_code}",
+                "message": str(e),
                 "page": page,
                 "pageSize": limit,
             }
 
-        # 检查响应内容是否为空
-        if not response.text:
-            print("待取件API返回空响应")
-            return {
-                "success": False,
-                "data": [],
-                "message": "API返回空响应",
+    requested = parse_fields(fields)
+    start_idx = (page - 1) * limit
+
+    if query is not None:
+        with metrics.phase("normalize"):
+            records = snapshot.index.take(snapshot.index.select(**query, descending=desc))
+        if shape == "grouped":
+            # 同一柜机的包裹在快照中相邻，筛选后仍然相邻
+            cabinets = [list(group) for _, group in groupby(records, key=attrgetter("boxName"))]
+            paged_data = [
+                group_cabinet(cabinet, requested)
+                for cabinet in cabinets[start_idx : start_idx + limit]
+            ]
+            return order_response(
+                {
+                    "success": True,
+                    "data": paged_data,
+                    "page": page,
+                    "pageSize": limit,
+                    "shape": "grouped",
+                    "cabinetTotal": len(cabinets),
+                    "total": len(records),
+                },
+                http_request,
+            )
+        return order_response(
+            {
+                "success": True,
+                "data": to_dicts(records[start_idx : start_idx + limit], requested),
                 "page": page,
                 "pageSize": limit,
-            }
-
-        # 尝试解析JSON
-        try:
-            response_data = response.json()
-        except Exception as e:
-            return {
-                "success": False,
-                "data": [],
-                "message": f"API请求异常: {str(e)}",
+                "total": len(records),
+            },
+            http_request,
+        )
+
+    if shape == "grouped":
+        cabinets = snapshot.cabinet_indexes()
+        with metrics.phase("normalize"):
+            paged_data = [
+                group_cabinet(snapshot.cabinet_records(ci), requested)
+                for ci in cabinets[start_idx : start_idx + limit]
+            ]
+        return order_response(
+            {
+                "success": True,
+                "data": paged_data,
                 "page": page,
                 "pageSize": limit,
-            }
-    except Exception as e:
-        return {
-            "success": False,
-            "data": [],
-            "message": f"API请求异常: {str(e)}",
-            "page": page,
-            "pageSize": limit,
-        }
+                "shape": "grouped",
+                "cabinetTotal": len(cabinets),
+            },
+            http_request,
+        )
 
-    # 打印原始响应数据
-    print(f"丰巢API返回的原始数据(待取件, 页码{page}):", response_data)
+    if position is not None:
+        try:
+            start = snapshot.cursor_start(position)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+    else:
+        start = snapshot.offset_start(start_idx)
+    with metrics.phase("normalize"):
+        records, next_cursor = snapshot.page(start, limit)
 
-    # 处理pending_orders的复杂数据层级
-    pending_data = []
+    if next_cursor is not None:
+        # 保留签发游标的快照，后续页面都从它取数
+        key = (authorization, snapshot.version)
+        if pending_cursor_snapshots.get(key) is None:
+            pending_cursor_snapshots.set(key, snapshot)
 
-    try:
-        if (
-            response_data.get("success")
-            and response_data.get("data")
-            and "cabinets" in response_data["data"]
-        ):
-            cabinets = response_data["data"]["cabinets"]
-
-            # 遍历所有的柜机
-            for cabinet in cabinets:
-                cabinet_code = cabinet.get("cabinetCode", "")
-                cabinet_address = cabinet.get("address", "")
-
-                # 遍历柜机中的所有箱子
-                if "boxes" in cabinet:
-                    for box in cabinet["boxes"]:
-                        box_id = box.get("boxId", "")
-                        box_location = box.get("location", "")
-
-                        # 遍历箱子中的所有包裹
-                        if "packages" in box:
-                            for package in box["packages"]:
-                                # 标准化数据结构
-                                normalized_package = {
-                                    "expressId": package.get("expressId", ""),
-                                    "companyName": package.get(
-                                        "companyName", "未知快递"
-                                    ),
-                                    "courierName": package.get("companyName", "未知"),
-                                    "pickupCode": package.get("code", ""),
-                                    "boxNo": box_id,
-                                    "boxName": cabinet_code,
-                                    "boxLocation": box_location,
-                                    "address": cabinet_address,
-                                    "sendTm": package.get("sendTm", ""),
-                                    "clientMobile": package.get("clientMobile", ""),
-                                    "pickStatus": package.get("pickStatus", ""),
-                                    "pickStatusDesc": package.get(
-                                        "pickStatusDesc", "待取件"
-                                    ),
-                                    "postId": package.get("postId", ""),
-                                    "expressStatus": "1",
-                                    "companyLogoUrl": package.get("companyLogoUrl", ""),
-                                    "staffMobile": package.get("staffMobile", ""),
-                                    "totalCustodyFee": package.get(
-                                        "totalCustodyFee", "0"
-                                    ),
-                                    "custodyFeeTag": package.get(
-                                        "custodyFeeInfo", ""
-                                    ).get("custodyFeeTag", ""),
-                                    "boxGlobalRow": package.get("boxGlobalRow", ""),
-                                }
-                                pending_data.append(normalized_package)
-    except Exception as e:
-        return {
-            "success": False,
-            "data": [],
-            "message": f"API请求异常: {str(e)}",
+    # 规范化返回格式
+    return order_response(
+        {
+            "success": True,
+            "data": to_dicts(records, requested),
             "page": page,
             "pageSize": limit,
-        }
+            "nextCursor": next_cursor,
+        },
+        http_request,
+    )
 
-    start_idx = (page - 1) * limit
-    end_idx = start_idx + limit
 
-    # 进行分页处理
-    if start_idx < len(pending_data):
-        paged_data = pending_data[start_idx:end_idx]
-    else:
-        paged_data = []
+def get_multi_account_semaphore():
+    global _multi_account_semaphore
+    if _multi_account_semaphore is None:
+        _multi_account_semaphore = asyncio.Semaphore(MULTI_ACCOUNT_CONCURRENCY)
+    return _multi_account_semaphore
 
-    # 规范化返回格式
-    return {"success": True, "data": paged_data, "page": page, "pageSize": limit}
 
+@app.post("/pending_orders/multi")
+async def get_multi_account_pending_orders(request: MultiAccountPendingRequest):
+    """并发查询多个账号的待取订单并合并
 
-@app.post("/cabinet_location")
-async def get_cabinet_location(
-    request: CabinetLocationRequest, authorization: str = Header(None)
-):
+    每个订单带上 account 字段(账号的label，未提供时为其在列表中的下标)。
+    单个账号失败或超时不影响其他账号，失败信息在 accounts 中返回。
+    """
+    deadline = request.deadline or MULTI_ACCOUNT_DEADLINE
+    deadline = max(1.0, min(deadline, MULTI_ACCOUNT_MAX_DEADLINE))
+    semaphore = get_multi_account_semaphore()
+
+    async def load_account(index, account):
+        tag = account.label or str(index)
+        authorization = account.authorization
+
+        async def load():
+            async with semaphore:
+                return await pending_orders_cache.get_or_load(
+                    authorization,
+                    lambda: fetch_pending_orders(authorization),
+                    refresh=request.refresh,
+                )
+
+        try:
+            snapshot = await asyncio.wait_for(load(), deadline)
+        except asyncio.TimeoutError:
+            return tag, None, f"查询超时({deadline:g}秒)"
+        except UpstreamError as e:
+            return tag, None, str(e)
+        return tag, snapshot.records, None
+
+    results = await asyncio.gather(
+        *(load_account(index, account) for index, account in enumerate(request.accounts))
+    )
+
+    merged = []
+    accounts = []
+    for tag, pending_data, error in results:
+        if error is not None:
+            accounts.append({"account": tag, "success": False, "count": 0, "message": error})
+            continue
+        accounts.append({"account": tag, "success": True, "count": len(pending_data)})
+        merged.extend({**order.to_dict(), "account": tag} for order in pending_data)
+
+    return {
+        "success": any(account["success"] for account in accounts) or not accounts,
+        "data": merged,
+        "accounts": accounts,
+    }
+
+
+async def poll_pending_orders(authorization):
+    """后台轮询使用: 拉取最新待取快照并顺便刷新快照缓存"""
+    snapshot = await fetch_pending_orders(authorization)
+    pending_orders_cache.set(authorization, snapshot)
+    return snapshot.records
+
+
+pending_event_hub = PendingEventHub(fetch=poll_pending_orders)
+
+
+@app.post("/pending_orders/events/ticket")
+async def issue_pending_events_ticket(authorization: str = Header(None)):
+    """签发建立推送连接用的一次性票据
+
+    先用Authorization拉取一次待取订单(走快照缓存)，上游接受该token才签发。
+    """
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header is required")
+    try:
+        await pending_orders_cache.get_or_load(
+            authorization, lambda: fetch_pending_orders(authorization)
+        )
+    except UpstreamError as e:
+        return {"success": False, "message": str(e)}
+
+    ticket = pending_event_ticket_cipher.encrypt(authorization.encode()).decode()
+    return {"success": True, "ticket": ticket, "expiresIn": PENDING_EVENTS_TICKET_TTL}
+
+
+@app.get("/pending_orders/events")
+async def pending_order_events(
+    authorization: str = Header(None), ticket: Optional[str] = None
+):
+    """以Server-Sent Events推送待取订单的变化
+
+    连接建立后先推送一次 snapshot(完整列表)，之后只在有变化时推送 change，
+    其中 added 为新增的包裹，removed 为已移除包裹的expressId。
+    浏览器的EventSource无法设置请求头，可以先通过 /pending_orders/events/ticket
+    获取一次性票据，再用 ticket 参数建立连接，Authorization不会出现在URL和日志中。
+    """
+    if not authorization and ticket and used_event_tickets.get(ticket) is None:
+        try:
+            authorization = pending_event_ticket_cipher.decrypt(
+                ticket.encode(), ttl=PENDING_EVENTS_TICKET_TTL
+            ).decode()
+        except InvalidToken:
+            authorization = None
+        else:
+            # 票据只能使用一次
+            used_event_tickets.set(ticket, True)
+    if not authorization:
+        raise HTTPException(
+            status_code=401, detail="Authorization header or valid ticket is required"
+        )
+
+    try:
+        queue = pending_event_hub.subscribe(authorization)
+    except TooManyPollers:
+        raise HTTPException(
+            status_code=503,
+            detail="推送连接数已达上限，请稍后重试",
+            headers={"Retry-After": str(int(PENDING_EVENTS_HEARTBEAT))},
+        )
+
+    async def generate():
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(
+                        queue.get(), PENDING_EVENTS_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                payload = json.dumps(data, ensure_ascii=False)
+                yield f"event: {event}\ndata: {payload}\n\n"
+        finally:
+            pending_event_hub.unsubscribe(authorization, queue)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    url = "https://consumer.fcbox.com/post/clientGet/cabinetVisualInfo"
+
+async def fetch_cabinet_visual_info(cabinet_code, authorization):
+    """请求cabinetVisualInfo获取柜机的可视化布局"""
+    url = f"{upstream.FCBOX_BASE_URL}/post/clientGet/cabinetVisualInfo"
 
     # 根据请求示例构建请求头
     headers = {
@@ -554,42 +1114,52 @@ async def get_cabinet_location(
     }
 
     # 构建表单数据，使用cabinetCode
-    form_data = f"cabinetCode={request.cabinetCode or ''}"
+    form_data = f"cabinetCode={cabinet_code}"
     try:
-        response = requests.post(url, data=form_data, headers=headers)
-        try:
-            response_data = response.json()
-        except Exception as e:
-            return {
-                "success": False,
-                "data": {},
-                "message": f"解析API响应失败: {str(e)}, 原始响应: {response.text[:100]}",
-            }
+        response = await upstream.post(url, content=form_data, headers=headers)
+    except Exception as e:
+        raise UpstreamError(f"API请求异常: {str(e)}")
 
-        if response.status_code != 200 or not response_data.get("success", False):
-            return {
-                "success": False,
-                "data": {},
-                "message": f"API返回错误: {response_data.get('message', '未知错误')}",
-            }
+    try:
+        response_data = upstream.decode_json(response)
+    except Exception as e:
+        raise UpstreamError(
+            f"解析API响应失败: {str(e)}, 原始响应: {response.text[:100]}"
+        )
 
-        # 处理返回的数据，返回标准格式
-        return {"success": True, "data": response_data.get("data", {})}
+    if response.status_code != 200 or not response_data.get("success", False):
+        raise UpstreamError(f"API返回错误: {response_data.get('message', '未知错误')}")
 
-    except Exception as e:
-        return {
-            "success": False,
-            "data": {},
-            "message": f"API请求异常: {str(e)}",
-        }
+    return response_data.get("data", {})
 
 
-@app.post("/openBox")
-async def openBox(request: OpenBoxRequest, authorization: str = Header(None)):
+@app.post("/cabinet_location", response_class=OrderListResponse)
+async def get_cabinet_location(
+    request: CabinetLocationRequest, http_request: Request, authorization: str = Header(None)
+):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header is required")
 
-    url = "https://consumer.fcbox.com/post/clientGet/openBox"
+    cabinet_code = request.cabinetCode or ""
+    try:
+        if cabinet_code:
+            # 柜机布局只与cabinetCode有关，且几乎不变，按柜机缓存
+            data = await cabinet_cache.get_or_load(
+                cabinet_code,
+                lambda: fetch_cabinet_visual_info(cabinet_code, authorization),
+            )
+        else:
+            data = await fetch_cabinet_visual_info(cabinet_code, authorization)
+    except UpstreamError as e:
+        return {"success": False, "data": {}, "message": str(e)}
+
+    # 处理返回的数据，返回标准格式
+    return order_response({"success": True, "data": data}, http_request)
+
+
+async def open_box(request, authorization):
+    """请求丰巢打开一个箱门，返回标准格式的结果"""
+    url = f"{upstream.FCBOX_BASE_URL}/post/clientGet/openBox"
 
     # 根据请求示例构建请求头
     headers = {
@@ -646,9 +1216,9 @@ async def openBox(request: OpenBoxRequest, authorization: str = Header(None)):
         "postId": request.postId,
     }
     try:
-        response = requests.post(url, json=data, headers=headers)
+        response = await upstream.post(url, json=data, headers=headers)
         try:
-            response_data = response.json()
+            response_data = upstream.decode_json(response)
         except Exception as e:
             return {
                 "success": False,
@@ -663,6 +1233,9 @@ async def openBox(request: OpenBoxRequest, authorization: str = Header(None)):
                 "message": f"API返回错误: {response_data.get('message', '未知错误')}",
             }
 
+        # 开箱成功后包裹状态已变化，丢弃该用户的待取订单快照
+        pending_orders_cache.invalidate(authorization)
+
         # 处理返回的数据，返回标准格式
         return {"success": True, "data": response_data.get("data", {})}
 
@@ -674,5 +1247,251 @@ async def openBox(request: OpenBoxRequest, authorization: str = Header(None)):
         }
 
 
+@app.post("/openBox")
+async def openBox(request: OpenBoxRequest, authorization: str = Header(None)):
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is required")
+
+    return await open_box(request, authorization)
+
+
+@app.post("/openBox/batch")
+async def open_box_batch(request: BatchOpenBoxRequest, authorization: str = Header(None)):
+    """批量开箱
+
+    不同柜机的开箱请求并发执行，同一柜机的按提交顺序依次执行，避免柜门互相抢占。
+    每个开箱请求单独计时，超时只影响该包裹。结果以NDJSON流按完成顺序返回，
+    每行带上该包裹在请求列表中的下标 index，最后一行为汇总。
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is required")
+
+    timeout = request.timeout or OPEN_BOX_ITEM_TIMEOUT
+    timeout = max(1.0, min(timeout, OPEN_BOX_MAX_ITEM_TIMEOUT))
+
+    # 按柜机分组，保持组内的提交顺序
+    groups = {}
+    for index, item in enumerate(request.items):
+        groups.setdefault(item.cabinetCode, []).append((index, item))
+
+    results = asyncio.Queue()
+
+    async def open_cabinet(items):
+        for index, item in items:
+            try:
+                result = await asyncio.wait_for(open_box(item, authorization), timeout)
+            except asyncio.TimeoutError:
+                result = {"success": False, "data": {}, "message": f"开箱超时({timeout:g}秒)"}
+            result = {
+                "index": index,
+                "expressId": item.expressId,
+                "cabinetCode": item.cabinetCode,
+                **result,
+            }
+            await results.put(result)
+
+    async def generate():
+        workers = [asyncio.ensure_future(open_cabinet(items)) for items in groups.values()]
+        succeeded = 0
+        try:
+            for _ in range(len(request.items)):
+                result = await results.get()
+                succeeded += 1 if result["success"] else 0
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        yield json.dumps(
+            {"type": "end", "total": len(request.items), "succeeded": succeeded},
+            ensure_ascii=False,
+        ) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def sync_completed_orders(authorization):
+    """增量同步已取订单到本地订单库，返回新增的订单数
+
+    pageQuery4App按时间倒序返回。/completed_orders 等接口也会顺带写入订单，
+    库中已有某个订单不代表更早的订单都已同步，所以只在翻到上次完整同步的
+    水位订单时停止；从未完整同步过时一直翻到最后一页。
+    """
+    store = order_store.get_store()
+    account = order_store.account_key(authorization)
+    watermark = await store.sync_watermark(account)
+    newest = None
+    added = 0
+    page = 1
+    while True:
+        orders, total = await fetch_completed_page(
+            authorization, page, ORDER_SYNC_PAGE_SIZE
+        )
+        if not orders:
+            break
+        if newest is None:
+            newest = orders[0].expressId
+
+        express_ids = [order.expressId for order in orders]
+        known = await store.known_ids(account, express_ids, order_store.STATUS_COMPLETED)
+        await store.upsert_orders(account, orders)
+        added += len(orders) - len(known)
+
+        try:
+            reached_end = page * ORDER_SYNC_PAGE_SIZE >= int(total)
+        except (TypeError, ValueError):
+            reached_end = len(orders) < ORDER_SYNC_PAGE_SIZE
+        if reached_end or (watermark is not None and watermark in express_ids):
+            break
+        page += 1
+
+    # 只有完整结束(没有因为上游错误中断)才推进水位
+    if newest:
+        await store.set_sync_watermark(account, newest)
+    return added
+
+
+@app.post("/local_orders/sync")
+async def sync_local_orders(authorization: str = Header(None)):
+    """从丰巢同步已取(增量)和待取订单到本地订单库"""
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is required")
+    if order_store.get_store() is None:
+        return {"success": False, "message": "本地订单库未启用"}
+
+    try:
+        added = await sync_completed_orders(authorization)
+        snapshot = await pending_orders_cache.get_or_load(
+            authorization, lambda: fetch_pending_orders(authorization), refresh=True
+        )
+    except UpstreamError as e:
+        return {"success": False, "message": str(e)}
+
+    return {"success": True, "completedAdded": added, "pendingTotal": len(snapshot)}
+
+
+@app.get("/local_orders")
+async def get_local_orders(
+    authorization: str = Header(None),
+    status: str = "completed",
+    page: int = 1,
+    limit: int = 10,
+    companyName: Optional[str] = None,
+    boxName: Optional[str] = None,
+    expressId: Optional[str] = None,
+    sort: str = "sendTm",
+    desc: bool = True,
+):
+    """从本地订单库分页查询订单，支持按快递公司、柜机、订单号筛选"""
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is required")
+    store = order_store.get_store()
+    if store is None:
+        return {"success": False, "data": [], "message": "本地订单库未启用"}
+
+    express_status = (
+        order_store.STATUS_PENDING if status == "pending" else order_store.STATUS_COMPLETED
+    )
+    orders, total = await store.query(
+        order_store.account_key(authorization),
+        express_status,
+        page=max(page, 1),
+        limit=max(limit, 1),
+        filters={"companyName": companyName, "boxName": boxName, "expressId": expressId},
+        sort=sort,
+        descending=desc,
+    )
+    return {
+        "success": True,
+        "data": orders,
+        "page": page,
+        "pageSize": limit,
+        "total": total,
+    }
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """各缓存的命中统计，用于评估缓存容量和有效期的配置"""
+    return {
+        "pending_orders": pending_orders_cache.stats(),
+        "pending_cursor": pending_cursor_snapshots.stats(),
+        "cabinet_location": cabinet_cache.stats(),
+        "pending_events": pending_event_hub.stats(),
+        "completed_prefetch": completed_prefetcher.stats(),
+        "completed_index": completed_index_cache.stats(),
+    }
+
+
+def collect_cache_metrics():
+    caches = {
+        "pending_orders": pending_orders_cache,
+        "pending_cursor": pending_cursor_snapshots,
+        "cabinet_location": cabinet_cache,
+        "completed_index": completed_index_cache,
+    }
+    samples = {"hits": [], "misses": [], "coalesced": [], "size": []}
+    for name, cache in caches.items():
+        stats = cache.stats()
+        for key in samples:
+            samples[key].append(({"cache": name}, stats[key]))
+    prefetch = completed_prefetcher.stats()
+    return [
+        ("fengchao_cache_hits_total", "counter", "缓存命中次数", samples["hits"]),
+        ("fengchao_cache_misses_total", "counter", "缓存未命中次数", samples["misses"]),
+        ("fengchao_cache_coalesced_total", "counter", "合并到进行中加载的请求数", samples["coalesced"]),
+        ("fengchao_cache_entries", "gauge", "缓存条目数", samples["size"]),
+        (
+            "fengchao_prefetch_pages_total",
+            "counter",
+            "已取订单预读的页数(issued发起、hits命中、misses未命中、wasted未使用)",
+            [({"result": key}, prefetch[key]) for key in ("issued", "hits", "misses", "wasted")],
+        ),
+    ]
+
+
+metrics.REGISTRY.register_callback(collect_cache_metrics)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus格式的指标"""
+    return PlainTextResponse(
+        metrics.REGISTRY.exposition(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 10.0,
+    requests: Optional[int] = None,
+    x_profiler_token: str = Header(None),
+):
+    """对整个进程做采样剖析，返回折叠格式的调用栈(可直接生成火焰图)
+
+    默认剖析接下来的 seconds 秒；指定 requests 时在处理完这么多个请求后提前结束。
+    需要在 X-Profiler-Token 头中提供环境变量 PROFILER_TOKEN 的值。
+    """
+    if not PROFILER_TOKEN or not hmac.compare_digest(
+        (x_profiler_token or "").encode(), PROFILER_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    until = None
+    if requests:
+        target = metrics.total_requests() + requests
+        until = lambda: metrics.total_requests() >= target  # noqa: E731
+
+    try:
+        result = await profiler.profile(seconds, until)
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="已有剖析任务在运行")
+
+    return PlainTextResponse(result.folded(), headers={"X-Profile-Samples": str(result.samples)})
+
+
 if __name__ == "__main__":
+    # 开发模式(自动重载)，生产环境使用 serve.py 启动多个worker
     uvicorn.run("app:app", host="0.0.0.0", port=5000, reload=True)
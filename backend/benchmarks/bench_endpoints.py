@@ -0,0 +1,256 @@
+"""后端接口压测
+
+以固定并发依次压测 backend/app.py 的各个接口，输出每个接口的 req/s 以及
+p50/p95/p99 延迟。配合 fake_fcbox.py 可以完全离线运行，用于检查性能回退。
+
+用法(在backend目录下):
+    # 自动启动模拟丰巢服务和后端，压测结束后关闭
+    python benchmarks/bench_endpoints.py --spawn --latency 0.05 --concurrency 50 --requests 500
+
+    # 压测已经在运行的后端(后端需以 FCBOX_BASE_URL 指向模拟服务启动)
+    python benchmarks/bench_endpoints.py --base-url http://127.0.0.1:5000
+
+    # 只压测部分接口，并把结果保存为JSON便于对比
+    python benchmarks/bench_endpoints.py --spawn --only pending_orders,openBox --output result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPEN_BOX_ITEM = {
+    "cabinetCode": "CAB0000",
+    "boxId": "1",
+    "expressId": "EX000000000",
+    "clientMobile": "138****0000",
+    "staffMobile": "139****0000",
+    "companyLogoUrl": "",
+    "companyName": "顺丰速运",
+    "expressType": 1,
+    "postId": "P000000000",
+    "code": "12345678",
+    "boxGlobalRow": "1",
+    "address": "模拟小区1号丰巢柜",
+}
+
+
+def build_scenarios(params, authorization):
+    """返回 {名称: (方法, 路径, 请求参数)}"""
+    headers = {"Authorization": authorization}
+    return {
+        "send_verification_code": (
+            "POST", "/send_verification_code", {"json": {"phoneNumber": "13800138000"}},
+        ),
+        "login": (
+            "POST",
+            "/login",
+            {
+                "json": {
+                    "phoneNumber": "13800138000",
+                    "verificationCode": "123456",
+                    "rsaPublicKey": params["rsa_public_key"],
+                    "clientIp": params["client_ip"],
+                    "requestCode": params["request_code"],
+                    "timestamp": params["timestamp"],
+                }
+            },
+        ),
+        "completed_orders": (
+            "GET", "/completed_orders", {"headers": headers, "params": {"page": 1, "limit": 10}},
+        ),
+        "completed_orders_all": ("GET", "/completed_orders/all", {"headers": headers}),
+        "pending_orders": (
+            "GET", "/pending_orders", {"headers": headers, "params": {"page": 1, "limit": 10}},
+        ),
+        "pending_orders_refresh": (
+            "GET",
+            "/pending_orders",
+            {"headers": headers, "params": {"page": 1, "limit": 10, "refresh": "true"}},
+        ),
+        "pending_orders_multi": (
+            "POST",
+            "/pending_orders/multi",
+            {"json": {"accounts": [{"authorization": f"{authorization}-{i}"} for i in range(10)]}},
+        ),
+        "cabinet_location": (
+            "POST",
+            "/cabinet_location",
+            {"headers": headers, "json": {"expressId": "EX000000000", "cabinetCode": "CAB0000"}},
+        ),
+        "openBox": ("POST", "/openBox", {"headers": headers, "json": OPEN_BOX_ITEM}),
+        "openBox_batch": (
+            "POST",
+            "/openBox/batch",
+            {
+                "headers": headers,
+                "json": {
+                    "items": [
+                        {**OPEN_BOX_ITEM, "cabinetCode": f"CAB{i % 2:04d}", "expressId": f"EX{i}"}
+                        for i in range(4)
+                    ]
+                },
+            },
+        ),
+    }
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_scenario(client, method, path, kwargs, total, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in counter:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                await response.aread()
+                ok = response.status_code == 200
+                # NDJSON等流式接口只看状态码，普通接口再检查success字段
+                if ok and response.headers.get("content-type", "").startswith("application/json"):
+                    ok = response.json().get("success", True) is not False
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        # 先走一遍发送验证码和登录，取得登录参数和Authorization
+        response = await client.post("/send_verification_code", json={"phoneNumber": "13800138000"})
+        params = response.json()["params"]
+        response = await client.post(
+            "/login",
+            json={
+                "phoneNumber": "13800138000",
+                "verificationCode": "123456",
+                "rsaPublicKey": params["rsa_public_key"],
+                "clientIp": params["client_ip"],
+                "requestCode": params["request_code"],
+                "timestamp": params["timestamp"],
+            },
+        )
+        authorization = response.json().get("authorization") or "bench-token"
+
+        scenarios = build_scenarios(params, authorization)
+        if args.only:
+            names = [name.strip() for name in args.only.split(",") if name.strip()]
+            scenarios = {name: scenarios[name] for name in names}
+
+        print(f"并发 {args.concurrency}，每个接口 {args.requests} 次请求")
+        print(f"{'接口':<24}{'req/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'错误':>8}")
+        results = {}
+        for name, (method, path, kwargs) in scenarios.items():
+            result = await run_scenario(
+                client, method, path, kwargs, args.requests, args.concurrency
+            )
+            results[name] = result
+            print(
+                f"{name:<24}{result['rps']:>10.1f}{result['p50_ms']:>10.1f}"
+                f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['errors']:>8}"
+            )
+        return results
+
+
+def wait_until_ready(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"服务未能在{timeout}秒内启动: {url}")
+
+
+def spawn_servers(args):
+    """启动模拟丰巢服务和后端，返回进程列表"""
+    fake_cmd = [
+        sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "fake_fcbox.py"),
+        "--port", str(args.fake_port),
+        "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate),
+        "--cabinets", str(args.cabinets),
+        "--boxes", str(args.boxes),
+        "--packages", str(args.packages),
+    ]
+    backend_port = httpx.URL(args.base_url).port or 5000
+    backend_cmd = [
+        sys.executable, "-m", "uvicorn", "app:app",
+        "--port", str(backend_port), "--log-level", "warning",
+    ]
+    env = dict(os.environ, FCBOX_BASE_URL=f"http://127.0.0.1:{args.fake_port}")
+
+    processes = [subprocess.Popen(fake_cmd, cwd=BACKEND_DIR)]
+    wait_until_ready(f"http://127.0.0.1:{args.fake_port}/docs")
+    processes.append(
+        subprocess.Popen(backend_cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    )
+    wait_until_ready(f"{args.base_url}/docs")
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端接口压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="每个接口的请求次数")
+    parser.add_argument("--only", help="只压测指定接口，逗号分隔")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--spawn", action="store_true", help="自动启动模拟丰巢服务和后端")
+    parser.add_argument("--fake-port", type=int, default=5100)
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟丰巢的平均延迟(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cabinets", type=int, default=3)
+    parser.add_argument("--boxes", type=int, default=2)
+    parser.add_argument("--packages", type=int, default=2)
+    args = parser.parse_args()
+
+    processes = spawn_servers(args) if args.spawn else []
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
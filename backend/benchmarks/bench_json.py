@@ -0,0 +1,105 @@
+"""订单列表JSON编解码的微基准
+
+分别在10、100、1000个订单的规模下，对比:
+- 上游响应解析: 标准库 json.loads 与 orjson.loads
+- 响应序列化: FastAPI默认流程(jsonable_encoder + 标准库json) 与 orjson 直接序列化
+
+用法(在backend目录下，需要安装orjson):
+    python benchmarks/bench_json.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from orders import normalize_pending_orders, to_dicts  # noqa: E402
+
+SIZES = (10, 100, 1000)
+PACKAGES_PER_BOX = 2
+BOXES_PER_CABINET = 5
+
+
+def make_upstream_payload(count):
+    """构造包含count个包裹的queryWaitPick响应"""
+    cabinets = []
+    index = 0
+    while index < count:
+        boxes = []
+        for box in range(BOXES_PER_CABINET):
+            packages = []
+            for _ in range(PACKAGES_PER_BOX):
+                if index >= count:
+                    break
+                packages.append(
+                    {
+                        "expressId": f"EX{index:08d}",
+                        "companyName": "顺丰速运",
+                        "companyLogoUrl": "https://static.example.com/logo/sf.png",
+                        "code": f"{index:08d}",
+                        "sendTm": "2025-03-01 10:00:00",
+                        "clientMobile": "138****0000",
+                        "pickStatus": "0",
+                        "pickStatusDesc": "待取件",
+                        "postId": f"P{index:08d}",
+                        "staffMobile": "139****0000",
+                        "totalCustodyFee": "0",
+                        "custodyFeeInfo": {"custodyFeeTag": ""},
+                        "boxGlobalRow": "1",
+                    }
+                )
+                index += 1
+            boxes.append({"boxId": str(box + 1), "location": f"{box + 1}号箱", "packages": packages})
+        cabinets.append(
+            {"cabinetCode": f"CAB{len(cabinets):04d}", "address": "模拟小区丰巢柜", "boxes": boxes}
+        )
+    return {"success": True, "data": {"cabinets": cabinets}}
+
+
+def stdlib_serialize(content):
+    # 与starlette JSONResponse.render一致
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def orjson_serialize(content):
+    return orjson.dumps(content)
+
+
+def bench(func, arg, number):
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print(
+        f"{'订单数':>8}{'解析json':>14}{'解析orjson':>14}"
+        f"{'序列化json':>14}{'序列化orjson':>16}{'序列化加速':>10}"
+    )
+    for size in SIZES:
+        payload = make_upstream_payload(size)
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        orders = to_dicts(normalize_pending_orders(payload))
+        content = {"success": True, "data": orders, "page": 1, "pageSize": size}
+        number = max(10, 20000 // size)
+
+        decode_std = bench(json.loads, body, number)
+        decode_fast = bench(orjson.loads, body, number)
+        encode_std = bench(stdlib_serialize, content, number)
+        encode_fast = bench(orjson_serialize, content, number)
+        print(
+            f"{size:>8}{decode_std:>12.1f}us{decode_fast:>12.1f}us"
+            f"{encode_std:>12.1f}us{encode_fast:>14.1f}us{encode_std / encode_fast:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
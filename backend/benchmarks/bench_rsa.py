@@ -0,0 +1,54 @@
+"""RSA签名加密的微基准
+
+对比每次都重新解析公钥(旧实现)与使用解析缓存后的单次加密耗时。
+公钥使用与丰巢下发格式一致的无头尾base64字符串，需要走第二级解析。
+
+用法(在backend目录下):
+    python benchmarks/bench_rsa.py [次数]
+"""
+import base64
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Crypto.PublicKey import RSA  # noqa: E402
+
+import rsa_keys  # noqa: E402
+
+SIGN = "8613800138000" + "0" * 32
+
+
+def make_key_string(bits=1024):
+    der = RSA.generate(bits).publickey().export_key(format="DER")
+    return base64.b64encode(der).decode()
+
+
+def uncached(key_string):
+    strategy, key = rsa_keys.parse_rsa_key(key_string)
+    return rsa_keys.encrypt_with_key(SIGN, strategy, key)
+
+
+def cached(key_string):
+    return rsa_keys.encrypt_with_rsa(SIGN, key_string)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    key_string = make_key_string()
+    rsa_keys.clear_key_cache()
+    cached(key_string)  # 预热缓存
+
+    results = {}
+    for name, func in (("每次解析(旧)", uncached), ("缓存解析(新)", cached)):
+        best = min(timeit.repeat(lambda: func(key_string), number=number, repeat=3))
+        results[name] = best / number * 1e6
+        print(f"{name}: {results[name]:.1f} us/次")
+
+    before, after = results["每次解析(旧)"], results["缓存解析(新)"]
+    print(f"加速比: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""丰巢接口的本地模拟服务
+
+模拟 backend/app.py 用到的全部上游接口，用于离线压测。延迟、错误率和数据量
+都可以配置，返回的数据结构与丰巢一致。
+
+用法(在backend目录下):
+    python benchmarks/fake_fcbox.py --port 5100 --latency 0.05 --cabinets 5 --boxes 4 --packages 2
+    FCBOX_BASE_URL=http://127.0.0.1:5100 python app.py
+
+也可以通过环境变量配置后用 uvicorn 启动:
+    FAKE_FCBOX_LATENCY=0.05 uvicorn benchmarks.fake_fcbox:app --port 5100
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import time
+
+from Crypto.PublicKey import RSA
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+# 平均延迟(秒)和抖动比例，实际延迟在 latency * (1 ± jitter) 之间
+LATENCY = float(os.environ.get("FAKE_FCBOX_LATENCY", "0.05"))
+JITTER = float(os.environ.get("FAKE_FCBOX_JITTER", "0.2"))
+# 返回500错误的概率
+ERROR_RATE = float(os.environ.get("FAKE_FCBOX_ERROR_RATE", "0"))
+# 待取件数据量: 柜机数 × 每个柜机的箱子数 × 每个箱子的包裹数
+CABINETS = int(os.environ.get("FAKE_FCBOX_CABINETS", "3"))
+BOXES = int(os.environ.get("FAKE_FCBOX_BOXES", "2"))
+PACKAGES = int(os.environ.get("FAKE_FCBOX_PACKAGES", "2"))
+# 已取件总数
+COMPLETED_TOTAL = int(os.environ.get("FAKE_FCBOX_COMPLETED_TOTAL", "200"))
+
+COMPANIES = ["顺丰速运", "中通快递", "圆通速递", "韵达快递", "京东物流"]
+
+app = FastAPI()
+
+_public_key = base64.b64encode(
+    RSA.generate(1024).publickey().export_key(format="DER")
+).decode()
+
+
+def configure(latency=None, jitter=None, error_rate=None, cabinets=None, boxes=None,
+              packages=None, completed_total=None):
+    global LATENCY, JITTER, ERROR_RATE, CABINETS, BOXES, PACKAGES, COMPLETED_TOTAL
+    LATENCY = LATENCY if latency is None else latency
+    JITTER = JITTER if jitter is None else jitter
+    ERROR_RATE = ERROR_RATE if error_rate is None else error_rate
+    CABINETS = CABINETS if cabinets is None else cabinets
+    BOXES = BOXES if boxes is None else boxes
+    PACKAGES = PACKAGES if packages is None else packages
+    COMPLETED_TOTAL = COMPLETED_TOTAL if completed_total is None else completed_total
+
+
+@app.middleware("http")
+async def simulate_network(request: Request, call_next):
+    """为每个请求加上延迟，并按错误率返回500"""
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY * random.uniform(1 - JITTER, 1 + JITTER))
+    if ERROR_RATE > 0 and random.random() < ERROR_RATE:
+        return JSONResponse({"success": False, "message": "模拟的服务端错误"}, status_code=500)
+    return await call_next(request)
+
+
+def make_package(cabinet, box, index):
+    return {
+        "expressId": f"EX{cabinet:03d}{box:03d}{index:03d}",
+        "companyName": COMPANIES[(cabinet + box + index) % len(COMPANIES)],
+        "companyLogoUrl": f"https://static.example.com/logo/{(cabinet + box + index) % len(COMPANIES)}.png",
+        "code": f"{random.randint(0, 99999999):08d}",
+        "sendTm": f"2025-03-{(index % 28) + 1:02d} 1{box % 10}:00:00",
+        "clientMobile": "138****0000",
+        "pickStatus": "0",
+        "pickStatusDesc": "待取件",
+        "postId": f"P{cabinet:03d}{box:03d}{index:03d}",
+        "expressType": 1,
+        "staffMobile": "139****0000",
+        "totalCustodyFee": "0",
+        "custodyFeeInfo": {"custodyFeeTag": ""},
+        "boxGlobalRow": str(box + 1),
+    }
+
+
+def make_completed_order(index):
+    return {
+        "expressId": f"DONE{index:06d}",
+        "companyName": COMPANIES[index % len(COMPANIES)],
+        "companyLogoUrl": f"https://static.example.com/logo/{index % len(COMPANIES)}.png",
+        "code": f"{index:08d}",
+        "boxId": str(index % 40 + 1),
+        "cabinetCode": f"CAB{index % 7:04d}",
+        "boxLocation": f"{index % 5 + 1}号柜",
+        "address": "模拟小区东门丰巢柜",
+        "sendTm": "2025-01-01 10:00:00",
+        "pickTm": "2025-01-02 18:00:00",
+        "clientMobile": "138****0000",
+        "pickStatus": "1",
+        "pickStatusDesc": "已取件",
+        "postId": f"DP{index:06d}",
+        "staffMobile": "139****0000",
+        "totalCustodyFee": "0",
+        "custodyFeeInfo": {"custodyFeeTag": ""},
+    }
+
+
+@app.get("/v1/account/secureCheckMobile")
+async def secure_check_mobile():
+    size = len(_public_key) // 5 + 1
+    parts = [_public_key[i * size:(i + 1) * size] for i in range(5)]
+    order = [3, 1, 5, 2, 4]
+    data = {f"key{number}": parts[position] for position, number in enumerate(order)}
+    data.update(
+        {
+            "keyOrder": ",".join(str(number) for number in order),
+            "clientIp": "127.0.0.1",
+            "requestCode": "fake-request-code",
+            "timestamp": str(int(time.time() * 1000)),
+            "needSliderCode": "false",
+        }
+    )
+    return {"success": True, "data": data}
+
+
+@app.post("/v1/account/secureSendCode")
+async def secure_send_code():
+    return {"success": True, "code": "0", "msg": "验证码已发送"}
+
+
+@app.post("/v1/account/secureLoginByPhone")
+async def secure_login_by_phone():
+    return JSONResponse(
+        {"success": True, "data": {"userId": "10000001", "nickName": "模拟用户", "mobile": "138****0000"}},
+        headers={"Authorization": f"fake-token-{random.randint(0, 1 << 30)}"},
+    )
+
+
+@app.post("/post/express/pageQuery4App")
+async def page_query_4_app(request: Request):
+    form = await request.form()
+    page = int(form.get("pageNo", "1"))
+    size = int(form.get("pageSize", "10"))
+    start = (page - 1) * size
+    orders = [make_completed_order(i) for i in range(start, min(start + size, COMPLETED_TOTAL))]
+    return {"success": True, "data": {"expressInfoDtos": orders, "total": COMPLETED_TOTAL}}
+
+
+@app.get("/post/mobilePick/queryWaitPick")
+async def query_wait_pick():
+    cabinets = []
+    for cabinet in range(CABINETS):
+        boxes = [
+            {
+                "boxId": str(box + 1),
+                "location": f"{box + 1}号箱",
+                "packages": [make_package(cabinet, box, index) for index in range(PACKAGES)],
+            }
+            for box in range(BOXES)
+        ]
+        cabinets.append(
+            {"cabinetCode": f"CAB{cabinet:04d}", "address": f"模拟小区{cabinet + 1}号丰巢柜", "boxes": boxes}
+        )
+    return {"success": True, "data": {"cabinets": cabinets}}
+
+
+@app.post("/post/clientGet/cabinetVisualInfo")
+async def cabinet_visual_info(request: Request):
+    form = await request.form()
+    cabinet_code = form.get("cabinetCode", "")
+    return {
+        "success": True,
+        "data": {
+            "cabinetCode": cabinet_code,
+            "columns": [
+                {"columnNo": column, "boxes": [{"boxId": f"{column}-{row}", "row": row} for row in range(8)]}
+                for column in range(6)
+            ],
+        },
+    }
+
+
+@app.post("/post/clientGet/openBox")
+async def open_box():
+    return {"success": True, "data": {"openResult": "1"}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="丰巢接口的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--latency", type=float, help="平均延迟(秒)")
+    parser.add_argument("--jitter", type=float, help="延迟抖动比例")
+    parser.add_argument("--error-rate", type=float, help="返回500错误的概率")
+    parser.add_argument("--cabinets", type=int, help="待取件的柜机数")
+    parser.add_argument("--boxes", type=int, help="每个柜机的箱子数")
+    parser.add_argument("--packages", type=int, help="每个箱子的包裹数")
+    parser.add_argument("--completed-total", type=int, help="已取件总数")
+    args = parser.parse_args()
+
+    configure(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        cabinets=args.cabinets,
+        boxes=args.boxes,
+        packages=args.packages,
+        completed_total=args.completed_total,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
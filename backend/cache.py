@@ -0,0 +1,127 @@
+"""进程内TTL缓存
+
+带过期时间和容量上限(LRU淘汰)的缓存，并支持请求合并(single-flight)：
+同一个key同时只会有一个加载任务在执行，其余并发请求等待同一个结果。
+
+传入 shared(shared_cache.namespace 的返回值)时，缓存值同时写入多个worker
+共享的存储；本地副本只作为读取加速，每次读取前核对共享存储中的版本号，
+其他worker写入或失效后本地副本随之失效。请求合并仍然只在进程内生效。
+共享存储暂时不可用时退回使用本地副本；写入共享存储失败的值只保存在本地，
+有效期内不再核对共享存储中的版本。
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from shared_cache import UNAVAILABLE
+
+
+class TTLCache:
+    def __init__(self, ttl, maxsize=1024, shared=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared = shared
+        # key -> (过期时间, 值, 共享存储中的版本号)，版本号为None表示只在本地
+        self._data = OrderedDict()
+        self._inflight = {}  # key -> 正在执行的加载任务
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # 合并到进行中加载任务的请求数
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """读取未过期的缓存值，不影响命中统计"""
+        if self.shared is not None:
+            return self._get_shared(key, default)
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def _get_shared(self, key, default):
+        entry = self._data.get(key)
+        fresh = entry is not None and entry[0] > time.monotonic()
+        if fresh:
+            if entry[2] is None or self.shared.version(key) in (entry[2], UNAVAILABLE):
+                self._data.move_to_end(key)
+                return entry[1]
+        shared_entry = self.shared.get(key)
+        if shared_entry is UNAVAILABLE:
+            return entry[1] if fresh else default
+        if shared_entry is None:
+            self._data.pop(key, None)
+            return default
+        version, ttl, value = shared_entry
+        self._store_local(key, value, ttl, version)
+        return value
+
+    def _store_local(self, key, value, ttl, version=None):
+        self._data[key] = (time.monotonic() + ttl, value, version)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        version = self.shared.set(key, value, ttl) if self.shared is not None else None
+        self._store_local(key, value, ttl, version)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self._data.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    async def get_or_load(self, key, loader, refresh=False):
+        """返回缓存值，未命中时调用 loader() 加载
+
+        refresh=True 时跳过缓存强制重新加载；加载失败时异常会抛给所有等待者，
+        且不会写入缓存。
+        """
+        if not refresh:
+            missing = object()
+            value = self.get(key, missing)
+            if value is not missing:
+                self.hits += 1
+                return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # shield: 某个等待者被取消时不影响其他等待者
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
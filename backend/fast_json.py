@@ -0,0 +1,56 @@
+"""JSON编解码
+
+默认使用标准库json。设置环境变量 FAST_JSON=1 并安装 orjson 后，上游响应的解析
+以及订单列表接口的响应序列化改用 orjson。未安装 orjson 时自动退回标准库。
+"""
+import json
+import os
+
+from fastapi.responses import JSONResponse
+
+import http_cache
+import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson为可选依赖
+    orjson = None
+
+FAST_JSON = os.environ.get("FAST_JSON", "").lower() in ("1", "true", "yes")
+ENABLED = FAST_JSON and orjson is not None
+
+
+def loads(data):
+    """解析JSON，data可以是bytes或str"""
+    if ENABLED:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class TimedJSONResponse(JSONResponse):
+    """计入 serialize 阶段耗时的JSON响应"""
+
+    def render(self, content):
+        with metrics.phase("serialize"):
+            return super().render(content)
+
+
+class ORJSONResponse(JSONResponse):
+    """使用orjson序列化并计入 serialize 阶段耗时的JSON响应"""
+
+    def render(self, content):
+        with metrics.phase("serialize"):
+            return orjson.dumps(content)
+
+
+# 订单列表类接口使用的响应类
+OrderListResponse = ORJSONResponse if ENABLED else TimedJSONResponse
+
+
+def order_response(content, request):
+    """返回订单列表类接口的响应
+
+    直接构造响应对象，跳过FastAPI对返回值逐层调用的jsonable_encoder(内容已经是
+    普通的dict/list)，并按请求加上ETag、处理304和压缩。
+    """
+    return http_cache.conditional_response(request, OrderListResponse(content))
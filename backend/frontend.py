@@ -0,0 +1,118 @@
+"""托管前端构建产物(vite build 的输出)
+
+设置 FRONTEND_DIST 为前端 dist 目录后，后端同时提供页面和接口，页面与接口同源，
+浏览器不再需要跨域预检请求:
+
+- /api/... 去掉前缀后交给接口处理，与开发时 Vite 代理的规则一致
+- dist 中存在的文件直接返回；构建时预先压缩好的 .br / .gz 按 Accept-Encoding 选用
+- assets/ 下的文件名带内容哈希，返回一年的 immutable 缓存；其他文件(index.html 等)
+  每次向服务器验证(ETag)
+- 其他浏览器页面请求(Accept 包含 text/html)返回 index.html，交给前端路由处理；
+  路径是接口路由(/metrics、/docs 等)时仍交给接口，在浏览器中直接打开接口不受影响
+"""
+import hashlib
+import mimetypes
+import os
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.routing import Match
+
+FRONTEND_DIST = os.environ.get("FRONTEND_DIST", "")
+
+API_PREFIX = "/api"
+# Vite 输出的带内容哈希的静态资源目录
+ASSETS_PREFIX = "/assets/"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# 预压缩文件的扩展名，按优先顺序
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _accepted_encodings(headers):
+    accepted = set()
+    for item in headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                if float(value) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class FrontendMiddleware:
+    """在接口之前处理页面和静态资源请求的ASGI中间件"""
+
+    def __init__(self, app, directory, routes=()):
+        self.app = app
+        self.directory = os.path.realpath(directory)
+        self.index = os.path.join(self.directory, "index.html")
+        # 接口的路由列表(app.routes)，用于判断页面请求是否其实是接口
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path == API_PREFIX or path.startswith(API_PREFIX + "/"):
+            path = path[len(API_PREFIX):] or "/"
+            scope = {**scope, "path": path, "raw_path": path.encode()}
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] in ("GET", "HEAD"):
+            headers = Headers(scope=scope)
+            file_path = self._lookup(path)
+            if (
+                file_path is None
+                and "text/html" in headers.get("accept", "")
+                and not self._is_route(scope)
+            ):
+                file_path = self.index
+            if file_path is not None:
+                response = self._file_response(file_path, path, headers)
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+    def _is_route(self, scope):
+        return any(route.matches(scope)[0] != Match.NONE for route in self.routes)
+
+    def _lookup(self, path):
+        """返回请求路径对应的dist中的文件，不存在或越出dist目录时返回None"""
+        if path == "/":
+            return self.index
+        full_path = os.path.realpath(os.path.join(self.directory, path.lstrip("/")))
+        if not full_path.startswith(self.directory + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path
+
+    def _file_response(self, file_path, path, headers):
+        media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        cache_control = IMMUTABLE_CACHE if path.startswith(ASSETS_PREFIX) else REVALIDATE_CACHE
+        response_headers = {"cache-control": cache_control, "vary": "Accept-Encoding"}
+
+        accepted = _accepted_encodings(headers)
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(file_path + suffix):
+                file_path += suffix
+                response_headers["content-encoding"] = coding
+                break
+
+        stat_result = os.stat(file_path)
+        etag_base = f"{file_path}-{stat_result.st_mtime}-{stat_result.st_size}"
+        etag = f'"{hashlib.md5(etag_base.encode()).hexdigest()}"'
+        response_headers["etag"] = etag
+        if etag in headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=response_headers)
+        return FileResponse(
+            file_path, headers=response_headers, media_type=media_type, stat_result=stat_result
+        )
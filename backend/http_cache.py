@@ -0,0 +1,89 @@
+"""订单列表响应的条件请求和压缩
+
+- 按响应内容计算ETag，请求的 If-None-Match 与之相同时返回不带内容的304，
+  下拉刷新时数据没有变化就不必重新下载整页订单
+- 超过 COMPRESS_MIN_SIZE 字节的响应按 Accept-Encoding 协商压缩，
+  安装了 brotli 时优先使用br，否则使用gzip
+"""
+import gzip
+import hashlib
+import os
+
+from starlette.responses import Response
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli为可选依赖
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# 订单数据因账号而异，只允许浏览器缓存，并且每次使用前都向服务器验证
+CACHE_CONTROL = "private, no-cache"
+
+
+def content_etag(body):
+    """响应内容的弱ETag(压缩与否内容相同，使用弱校验)"""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(
+        candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(",")
+    )
+
+
+def _accepts(accept_encoding, coding):
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() != coding:
+            continue
+        key, _, value = params.strip().partition("=")
+        if key.strip() == "q":
+            try:
+                return float(value) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _compress(body, accept_encoding):
+    """返回 (压缩后的内容, 编码)，不压缩时编码为None"""
+    if len(body) < COMPRESS_MIN_SIZE or not accept_encoding:
+        return body, None
+    with metrics.phase("compress"):
+        if brotli is not None and _accepts(accept_encoding, "br"):
+            return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+        if _accepts(accept_encoding, "gzip"):
+            return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def conditional_response(request, response):
+    """给已渲染的响应加上ETag，命中时改为304，否则按需压缩"""
+    body = response.body
+    etag = content_etag(body)
+    headers = {"etag": etag, "cache-control": CACHE_CONTROL, "vary": "Accept-Encoding"}
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    compressed, encoding = _compress(body, request.headers.get("accept-encoding", ""))
+    if encoding is not None:
+        headers["content-encoding"] = encoding
+    return Response(
+        compressed,
+        status_code=response.status_code,
+        headers=headers,
+        media_type=response.media_type,
+    )
@@ -0,0 +1,274 @@
+"""Prometheus文本格式的指标
+
+提供计数器、仪表盘和直方图，以及统计每个接口请求数、耗时和进行中请求数的
+ASGI中间件。处理过程中的各个阶段(上游等待、RSA加密、JSON解析、数据规范化、
+响应序列化)通过 phase() 记录，按接口分别统计，并通过 Server-Timing 响应头
+返回给调用方(浏览器开发者工具的 Timing 面板可以直接查看)。
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from starlette.routing import Match
+
+# 是否在响应中附带 Server-Timing 头
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1").lower() not in ("0", "false", "no")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [各桶计数..., 总和, 总数]
+
+    def observe(self, *labels, value):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+
+    def collect(self):
+        for labels, entry in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                extra = (("le", repr(float(bound))),)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, extra)} {cumulative}"
+            extra = (("le", "+Inf"),)
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, extra)} {entry[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {entry[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {entry[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_callback(self, callback):
+        """注册在导出时调用的回调，回调返回 [(指标名, 类型, 说明, [(标签dict, 值)])]"""
+        self._callbacks.append(callback)
+
+    def exposition(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        for callback in self._callbacks:
+            for name, metric_type, documentation, samples in callback():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter("fengchao_http_requests_total", "接口请求数", ("endpoint", "method", "status"))
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram("fengchao_http_request_duration_seconds", "接口处理耗时", ("endpoint", "method"))
+)
+HTTP_IN_FLIGHT = REGISTRY.register(
+    Gauge("fengchao_http_requests_in_flight", "正在处理的接口请求数", ("endpoint",))
+)
+HANDLER_PHASE = REGISTRY.register(
+    Histogram("fengchao_handler_phase_seconds", "接口各处理阶段的耗时", ("endpoint", "phase"))
+)
+UPSTREAM_REQUESTS = REGISTRY.register(
+    Counter("fengchao_upstream_requests_total", "丰巢接口请求数", ("api", "status"))
+)
+UPSTREAM_LATENCY = REGISTRY.register(
+    Histogram("fengchao_upstream_request_duration_seconds", "丰巢接口请求耗时", ("api",))
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.register(
+    Gauge("fengchao_upstream_requests_in_flight", "正在进行的丰巢接口请求数", ("api",))
+)
+UPSTREAM_RETRIES = REGISTRY.register(
+    Counter("fengchao_upstream_retries_total", "丰巢只读接口的重试次数", ("api",))
+)
+UPSTREAM_HEDGES = REGISTRY.register(
+    Counter("fengchao_upstream_hedges_total", "丰巢只读接口超过p95后发出的对冲请求数", ("api",))
+)
+UPSTREAM_CIRCUIT_OPEN = REGISTRY.register(
+    Gauge("fengchao_upstream_circuit_open", "丰巢接口熔断状态(1为熔断中)", ("api",))
+)
+UPSTREAM_CIRCUIT_REJECTED = REGISTRY.register(
+    Counter("fengchao_upstream_circuit_rejected_total", "熔断期间被直接拒绝的请求数", ("api",))
+)
+ADMISSION_REJECTED = REGISTRY.register(
+    Counter("fengchao_admission_rejected_total", "准入控制拒绝的请求数", ("pool", "reason"))
+)
+ADMISSION_ACTIVE = REGISTRY.register(
+    Gauge("fengchao_admission_active", "各资源池正在处理的请求数", ("pool",))
+)
+ADMISSION_QUEUED = REGISTRY.register(
+    Gauge("fengchao_admission_queued", "各资源池排队等待的请求数", ("pool",))
+)
+
+
+class RequestTimings:
+    """单个请求内各阶段的累计耗时"""
+
+    __slots__ = ("endpoint", "phases")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.phases = {}
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def current_timings():
+    return _current.get()
+
+
+def record_phase(phase, duration):
+    """记录当前请求某个阶段的耗时，不在请求中(如后台任务)时按 background 统计"""
+    timings = _current.get()
+    endpoint = timings.endpoint if timings is not None else "background"
+    HANDLER_PHASE.observe(endpoint, phase, value=duration)
+    if timings is not None:
+        timings.phases[phase] = timings.phases.get(phase, 0.0) + duration
+
+
+def total_requests():
+    """已处理完成的接口请求总数"""
+    return sum(HTTP_REQUESTS._values.values())
+
+
+def server_timing(timings, total):
+    """生成 Server-Timing 头的值，耗时单位为毫秒"""
+    entries = [f"{name};dur={duration * 1000:.1f}" for name, duration in timings.phases.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def detach_request():
+    """在由请求派生的后台任务中调用，之后的阶段耗时按 background 统计，不计入该请求"""
+    _current.set(None)
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """统计每个接口的请求数、耗时和进行中的请求数
+
+    接口按路由的路径模板归类，未匹配任何路由的请求统一记为 other，避免标签数量失控。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._endpoint_cache = {}
+
+    def _endpoint(self, scope):
+        path = scope["path"]
+        endpoint = self._endpoint_cache.get(path)
+        if endpoint is not None:
+            return endpoint
+        for route in scope["app"].routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                endpoint = getattr(route, "path", path)
+                # 只缓存静态路由，带参数的路由和挂载点可能对应无限多的路径
+                if endpoint == path:
+                    self._endpoint_cache[path] = endpoint
+                return endpoint
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        method = scope["method"]
+        timings = RequestTimings(endpoint)
+        token = _current.set(timings)
+        status = "500"
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if SERVER_TIMING:
+                    # 流式响应只包含开始发送之前的阶段
+                    value = server_timing(timings, time.perf_counter() - start)
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", value.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(endpoint)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(endpoint)
+            HTTP_REQUESTS.inc(endpoint, method, status)
+            HTTP_LATENCY.observe(endpoint, method, value=time.perf_counter() - start)
+            _current.reset(token)
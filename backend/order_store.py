@@ -0,0 +1,246 @@
+"""本地订单库(SQLite)
+
+保存 /completed_orders 和 /pending_orders 规范化后的订单，支持增量同步以及
+按快递公司、柜机、时间的分页查询，读请求无需再访问丰巢。
+
+通过环境变量 ORDER_STORE_PATH 指定数据库文件后启用。账号以Authorization的
+哈希区分，不在库中保存token原文。所有数据库操作都在单独的线程中串行执行，
+不会阻塞事件循环。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ORDER_STORE_PATH = os.environ.get("ORDER_STORE_PATH", "")
+
+STATUS_PENDING = "1"
+STATUS_COMPLETED = "2"
+
+# 允许排序的字段 -> 列名
+SORT_COLUMNS = {"sendTm": "send_tm", "pickTm": "pick_tm"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    account TEXT NOT NULL,
+    express_id TEXT NOT NULL,
+    express_status TEXT NOT NULL,
+    box_name TEXT NOT NULL DEFAULT '',
+    company_name TEXT NOT NULL DEFAULT '',
+    send_tm TEXT NOT NULL DEFAULT '',
+    pick_tm TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (account, express_id)
+);
+CREATE INDEX IF NOT EXISTS idx_orders_send_tm ON orders (account, express_status, send_tm);
+CREATE INDEX IF NOT EXISTS idx_orders_pick_tm ON orders (account, express_status, pick_tm);
+CREATE INDEX IF NOT EXISTS idx_orders_box_name ON orders (account, box_name);
+CREATE INDEX IF NOT EXISTS idx_orders_company_name ON orders (account, company_name);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account TEXT PRIMARY KEY,
+    completed_watermark TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+def account_key(authorization):
+    """由Authorization生成账号标识"""
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+class OrderStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        # 单线程执行器: 保证连接只在同一个线程中使用，写操作天然串行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-store")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ---- 以下 _ 开头的方法都在数据库线程中执行 ----
+
+    def _open(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _upsert(self, account, orders):
+        now = time.time()
+        rows = [
+            (
+                account,
+                order.expressId,
+                order.expressStatus,
+                order.boxName or "",
+                order.companyName or "",
+                order.sendTm or "",
+                order.pickTm or "",
+                json.dumps(order.to_dict(), ensure_ascii=False),
+                now,
+            )
+            for order in orders
+            if order.expressId
+        ]
+        with self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO orders (account, express_id, express_status, box_name,
+                                    company_name, send_tm, pick_tm, data, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (account, express_id) DO UPDATE SET
+                    express_status = excluded.express_status,
+                    box_name = excluded.box_name,
+                    company_name = excluded.company_name,
+                    send_tm = excluded.send_tm,
+                    pick_tm = excluded.pick_tm,
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def _replace_pending(self, account, orders):
+        express_ids = [order.expressId for order in orders if order.expressId]
+        with self._conn:
+            # 不在最新待取列表中的包裹已被取走，先从待取中移除
+            placeholders = ",".join("?" * len(express_ids))
+            sql = "DELETE FROM orders WHERE account = ? AND express_status = ?"
+            if express_ids:
+                sql += f" AND express_id NOT IN ({placeholders})"
+            self._conn.execute(sql, [account, STATUS_PENDING, *express_ids])
+        return self._upsert(account, orders)
+
+    def _known_ids(self, account, express_ids, status):
+        if not express_ids:
+            return set()
+        placeholders = ",".join("?" * len(express_ids))
+        cursor = self._conn.execute(
+            f"SELECT express_id FROM orders WHERE account = ? AND express_status = ? "
+            f"AND express_id IN ({placeholders})",
+            [account, status, *express_ids],
+        )
+        return {row[0] for row in cursor}
+
+    def _sync_watermark(self, account):
+        row = self._conn.execute(
+            "SELECT completed_watermark FROM sync_state WHERE account = ?", (account,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_sync_watermark(self, account, express_id):
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO sync_state (account, completed_watermark, synced_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (account) DO UPDATE SET
+                    completed_watermark = excluded.completed_watermark,
+                    synced_at = excluded.synced_at
+                """,
+                (account, express_id, time.time()),
+            )
+
+    def _query(self, account, status, page, limit, filters, sort, descending):
+        where = ["account = ?", "express_status = ?"]
+        params = [account, status]
+        for column, value in (
+            ("express_id", filters.get("expressId")),
+            ("box_name", filters.get("boxName")),
+            ("company_name", filters.get("companyName")),
+        ):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        where_sql = " AND ".join(where)
+
+        total = self._conn.execute(
+            f"SELECT COUNT(*) FROM orders WHERE {where_sql}", params
+        ).fetchone()[0]
+
+        order_column = SORT_COLUMNS.get(sort, "send_tm")
+        direction = "DESC" if descending else "ASC"
+        cursor = self._conn.execute(
+            f"SELECT data FROM orders WHERE {where_sql} "
+            f"ORDER BY {order_column} {direction}, express_id LIMIT ? OFFSET ?",
+            [*params, limit, (page - 1) * limit],
+        )
+        return [json.loads(row[0]) for row in cursor], total
+
+    # ---- 异步接口 ----
+
+    async def open(self):
+        await self._run(self._open)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    async def upsert_orders(self, account, orders):
+        """写入或更新订单(OrderRecord)，返回写入的条数"""
+        return await self._run(self._upsert, account, orders)
+
+    async def replace_pending(self, account, orders):
+        """用最新的待取列表替换该账号的待取订单"""
+        return await self._run(self._replace_pending, account, orders)
+
+    async def known_ids(self, account, express_ids, status):
+        """返回express_ids中已存在于库中(且状态相同)的订单号"""
+        return await self._run(self._known_ids, account, list(express_ids), status)
+
+    async def sync_watermark(self, account):
+        """上次完整同步开始时最新的已取订单号，从未完整同步过时返回None
+
+        该订单及比它早的已取订单都已在库中(其他接口顺带写入的订单不算)。
+        """
+        return await self._run(self._sync_watermark, account)
+
+    async def set_sync_watermark(self, account, express_id):
+        """一次同步完整结束后记录水位"""
+        return await self._run(self._set_sync_watermark, account, express_id)
+
+    async def query(
+        self, account, status, page=1, limit=10, filters=None, sort="sendTm", descending=True
+    ):
+        """分页查询，返回 (订单列表, 符合条件的总数)"""
+        return await self._run(
+            self._query, account, status, page, limit, filters or {}, sort, descending
+        )
+
+
+_store = None
+
+
+async def startup():
+    """配置了ORDER_STORE_PATH时打开本地订单库"""
+    global _store
+    if ORDER_STORE_PATH and _store is None:
+        store = OrderStore(ORDER_STORE_PATH)
+        await store.open()
+        _store = store
+
+
+async def shutdown():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+def get_store():
+    """返回本地订单库，未启用时返回None"""
+    return _store
@@ -0,0 +1,506 @@
+"""丰巢订单数据的规范化
+
+把上游 pageQuery4App(已取件) 和 queryWaitPick(待取件) 返回的数据
+转换成统一的 OrderRecord。OrderRecord 使用 __slots__ 存储，同一柜机、同一快递
+公司的重复字符串共用同一个对象；只在返回给前端时才按需要的字段转换成字典。
+"""
+import base64
+import hashlib
+import json
+import sys
+
+# 待取订单和已取订单对外输出的字段及顺序
+PENDING_FIELDS = (
+    "expressId",
+    "companyName",
+    "courierName",
+    "pickupCode",
+    "boxNo",
+    "boxName",
+    "boxLocation",
+    "address",
+    "sendTm",
+    "clientMobile",
+    "pickStatus",
+    "pickStatusDesc",
+    "postId",
+    "expressStatus",
+    "companyLogoUrl",
+    "staffMobile",
+    "totalCustodyFee",
+    "custodyFeeTag",
+    "boxGlobalRow",
+)
+COMPLETED_FIELDS = (
+    "expressId",
+    "companyName",
+    "courierName",
+    "pickupCode",
+    "boxNo",
+    "boxName",
+    "boxLocation",
+    "address",
+    "sendTm",
+    "pickTm",
+    "clientMobile",
+    "pickStatus",
+    "pickStatusDesc",
+    "expressStatus",
+    "postId",
+    "companyLogoUrl",
+    "staffMobile",
+    "totalCustodyFee",
+    "custodyFeeTag",
+)
+ORDER_FIELDS = tuple(dict.fromkeys(PENDING_FIELDS + COMPLETED_FIELDS))
+
+_PENDING_FIELD_SET = frozenset(PENDING_FIELDS)
+_COMPLETED_FIELD_SET = frozenset(COMPLETED_FIELDS)
+
+
+def _intern(value):
+    """驻留重复率高的短字符串(快递公司、图标地址等)，多个订单共用同一个对象"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class OrderRecord:
+    """规范化后的订单"""
+
+    __slots__ = ORDER_FIELDS
+
+    def __init__(
+        self,
+        expressId="",
+        companyName="",
+        courierName="",
+        pickupCode="",
+        boxNo="",
+        boxName="",
+        boxLocation="",
+        address="",
+        sendTm="",
+        pickTm="",
+        clientMobile="",
+        pickStatus="",
+        pickStatusDesc="",
+        expressStatus="",
+        postId="",
+        companyLogoUrl="",
+        staffMobile="",
+        totalCustodyFee="0",
+        custodyFeeTag="",
+        boxGlobalRow="",
+    ):
+        self.expressId = expressId
+        self.companyName = companyName
+        self.courierName = courierName
+        self.pickupCode = pickupCode
+        self.boxNo = boxNo
+        self.boxName = boxName
+        self.boxLocation = boxLocation
+        self.address = address
+        self.sendTm = sendTm
+        self.pickTm = pickTm
+        self.clientMobile = clientMobile
+        self.pickStatus = pickStatus
+        self.pickStatusDesc = pickStatusDesc
+        self.expressStatus = expressStatus
+        self.postId = postId
+        self.companyLogoUrl = companyLogoUrl
+        self.staffMobile = staffMobile
+        self.totalCustodyFee = totalCustodyFee
+        self.custodyFeeTag = custodyFeeTag
+        self.boxGlobalRow = boxGlobalRow
+
+    @property
+    def is_pending(self):
+        return self.expressStatus == "1"
+
+    def field_names(self):
+        return PENDING_FIELDS if self.is_pending else COMPLETED_FIELDS
+
+    def to_dict(self, fields=None):
+        """转换成对外输出的字典，fields为None时输出该类订单的全部字段"""
+        if fields is None:
+            fields = self.field_names()
+        else:
+            allowed = _PENDING_FIELD_SET if self.is_pending else _COMPLETED_FIELD_SET
+            fields = [name for name in fields if name in allowed]
+        return {name: getattr(self, name) for name in fields}
+
+
+def parse_fields(value):
+    """解析 fields 查询参数(逗号分隔)，返回字段元组；为空时返回None表示全部字段"""
+    if not value:
+        return None
+    fields = tuple(
+        dict.fromkeys(name.strip() for name in value.split(",") if name.strip() in ORDER_FIELDS)
+    )
+    return fields or None
+
+
+def to_dicts(records, fields=None):
+    return [record.to_dict(fields) for record in records]
+
+
+# 分组输出时提到柜机、箱子层级的字段
+CABINET_FIELDS = ("boxName", "address")
+BOX_FIELDS = ("boxNo", "boxLocation")
+_GROUPED_FIELD_SET = frozenset(CABINET_FIELDS + BOX_FIELDS)
+
+
+def group_cabinet(records, fields=None):
+    """把同一柜机的包裹转换成 柜机 -> 箱子 -> 包裹 的层级，柜机和箱子的字段只输出一次"""
+    package_fields = [
+        name for name in (fields or PENDING_FIELDS) if name not in _GROUPED_FIELD_SET
+    ]
+    first = records[0]
+    boxes = []
+    box = None
+    for record in records:
+        if box is None or box["boxNo"] != record.boxNo:
+            box = {"boxNo": record.boxNo, "boxLocation": record.boxLocation, "packages": []}
+            boxes.append(box)
+        box["packages"].append(record.to_dict(package_fields))
+    return {"cabinetCode": first.boxName, "address": first.address, "boxes": boxes}
+
+
+# 可按值筛选和可排序的字段
+FILTER_FIELDS = ("companyName", "boxName", "pickStatus")
+SORT_FIELDS = ("sendTm", "pickTm")
+
+
+def has_custody_fee(record):
+    """该订单是否产生了保管费"""
+    try:
+        return float(record.totalCustodyFee or 0) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+class OrderIndex:
+    """一份订单列表的二级索引
+
+    规范化后一次建好: 筛选字段的 值 -> 下标列表、有无保管费的下标列表，
+    以及排序字段的名次。筛选时只遍历最短的下标列表，其余条件逐条核对；
+    排序时按预先算好的名次排列，不再比较字符串。
+    """
+
+    __slots__ = ("records", "_postings", "_fee_rows", "_orders", "_ranks")
+
+    def __init__(self, records):
+        self.records = records
+        postings = {name: {} for name in FILTER_FIELDS}
+        fee_rows = {True: [], False: []}
+        for row, record in enumerate(records):
+            for name, index in postings.items():
+                index.setdefault(getattr(record, name), []).append(row)
+            fee_rows[has_custody_fee(record)].append(row)
+        self._postings = postings
+        self._fee_rows = fee_rows
+
+        self._orders = {}
+        self._ranks = {}
+        for name in SORT_FIELDS:
+            # 同一时间的订单保持原有顺序，名次互不相同
+            # 上游可能返回null，按空字符串参与排序
+            order = sorted(
+                range(len(records)), key=lambda row: getattr(records[row], name) or ""
+            )
+            ranks = [0] * len(records)
+            for rank, row in enumerate(order):
+                ranks[row] = rank
+            self._orders[name] = order
+            self._ranks[name] = ranks
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, filters=None, custody_fee=None, sort=None, descending=True):
+        """返回符合条件的订单下标列表
+
+        filters 为 {字段: 值}，值为None的条件忽略；custody_fee 为True/False时
+        只保留有/无保管费的订单；sort 为排序字段，为None时保持原有顺序。
+        """
+        conditions = []
+        for name, value in (filters or {}).items():
+            if value is not None:
+                conditions.append(
+                    (
+                        self._postings[name].get(value, ()),
+                        lambda record, name=name, value=value: getattr(record, name) == value,
+                    )
+                )
+        if custody_fee is not None:
+            conditions.append(
+                (
+                    self._fee_rows[bool(custody_fee)],
+                    lambda record: has_custody_fee(record) == bool(custody_fee),
+                )
+            )
+
+        if not conditions:
+            if sort is None:
+                return list(range(len(self.records)))
+            order = self._orders[sort]
+            return order[::-1] if descending else list(order)
+
+        conditions.sort(key=lambda condition: len(condition[0]))
+        rows, _ = conditions[0]
+        checks = [check for _, check in conditions[1:]]
+        records = self.records
+        rows = [row for row in rows if all(check(records[row]) for check in checks)]
+        if sort is not None:
+            rows.sort(key=self._ranks[sort].__getitem__, reverse=descending)
+        return rows
+
+    def take(self, rows):
+        return [self.records[row] for row in rows]
+
+
+def normalize_completed_order(order):
+    """规范化单条已取订单，与待取订单保持一致"""
+    return OrderRecord(
+        expressId=order.get("expressId", ""),
+        companyName=_intern(order.get("companyName", "未知快递")),
+        courierName=_intern(order.get("companyName", "未知")),
+        pickupCode=order.get("code", ""),
+        boxNo=order.get("boxId", ""),
+        boxName=_intern(order.get("cabinetCode", "")),
+        boxLocation=order.get("boxLocation", ""),
+        address=_intern(order.get("address", "")),
+        sendTm=order.get("sendTm", ""),
+        pickTm=order.get("pickTm", ""),
+        clientMobile=order.get("clientMobile", order.get("pickerPhone", "")),
+        pickStatus=_intern(order.get("pickStatus", "")),
+        pickStatusDesc=_intern(order.get("pickStatusDesc", "已取件")),
+        expressStatus="2",  # 2表示已取件
+        postId=order.get("postId", ""),
+        companyLogoUrl=_intern(order.get("companyLogoUrl", "")),
+        staffMobile=order.get("staffMobile", ""),
+        totalCustodyFee=_intern(order.get("totalCustodyFee", "0")),
+        custodyFeeTag=_intern((order.get("custodyFeeInfo") or {}).get("custodyFeeTag", "")),
+    )
+
+
+def normalize_completed_orders(response_data):
+    """从pageQuery4App的响应中取出并规范化已取订单"""
+    orders = []
+    if response_data.get("success") and response_data.get("data"):
+        # 尝试从不同可能的路径中获取订单数据
+        raw_orders = []
+        if "expressInfoDtos" in response_data["data"]:
+            raw_orders = response_data["data"]["expressInfoDtos"]
+        elif "data" in response_data["data"]:
+            raw_orders = response_data["data"]["data"]
+
+        for order in raw_orders:
+            orders.append(normalize_completed_order(order))
+    return orders
+
+
+def normalize_pending_package(package, cabinet_code, cabinet_address, box_id, box_location):
+    """规范化单个待取包裹，柜机和箱子信息由外层传入并在同一柜机的包裹间共用"""
+    return OrderRecord(
+        expressId=package.get("expressId", ""),
+        companyName=_intern(package.get("companyName", "未知快递")),
+        courierName=_intern(package.get("companyName", "未知")),
+        pickupCode=package.get("code", ""),
+        boxNo=box_id,
+        boxName=cabinet_code,
+        boxLocation=box_location,
+        address=cabinet_address,
+        sendTm=package.get("sendTm", ""),
+        clientMobile=package.get("clientMobile", ""),
+        pickStatus=_intern(package.get("pickStatus", "")),
+        pickStatusDesc=_intern(package.get("pickStatusDesc", "待取件")),
+        postId=package.get("postId", ""),
+        expressStatus="1",
+        companyLogoUrl=_intern(package.get("companyLogoUrl", "")),
+        staffMobile=package.get("staffMobile", ""),
+        totalCustodyFee=_intern(package.get("totalCustodyFee", "0")),
+        custodyFeeTag=_intern((package.get("custodyFeeInfo") or {}).get("custodyFeeTag", "")),
+        boxGlobalRow=package.get("boxGlobalRow", ""),
+    )
+
+
+def encode_cursor(position):
+    """把包裹位置编码成不透明的游标字符串"""
+    raw = json.dumps(position, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (快照版本, 包裹位置)，格式不正确时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value = json.loads(raw)
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(value, list) or len(value) != 7 or not isinstance(value[0], str):
+        raise ValueError("invalid cursor")
+    version, position = value[0], value[1:]
+    if not all(isinstance(position[i], int) and position[i] >= 0 for i in (0, 2, 4)):
+        raise ValueError("invalid cursor")
+    return version, position
+
+
+class PendingSnapshot:
+    """一次queryWaitPick的结果
+
+    保留上游 柜机 -> 箱子 -> 包裹 的原始层级，按页取数时只规范化返回的包裹。
+    包裹位置为 [柜机下标, cabinetCode, 箱子下标, boxId, 包裹下标, expressId]，
+    游标记录快照版本和上一页最后一个包裹的位置，后续页面从同一个快照中取，
+    翻页期间刷新出的新快照(有包裹被取走或新到)不影响已经开始的翻页。
+    版本由内容哈希得到，内容相同的快照游标相同，响应的ETag也就相同。
+    """
+
+    __slots__ = ("cabinets", "_version", "_records", "_index")
+
+    def __init__(self, response_data, version=None):
+        cabinets = []
+        if (
+            response_data.get("success")
+            and response_data.get("data")
+            and "cabinets" in response_data["data"]
+        ):
+            cabinets = response_data["data"]["cabinets"]
+        self.cabinets = cabinets
+        self._version = version
+        self._records = None
+        self._index = None
+
+    def to_json(self):
+        """序列化成与上游响应相同结构的JSON(附带快照版本)，用于写入共享缓存"""
+        return json.dumps(
+            {"success": True, "data": {"cabinets": self.cabinets}, "version": self.version},
+            ensure_ascii=False,
+        )
+
+    @classmethod
+    def from_json(cls, data):
+        response_data = json.loads(data)
+        return cls(response_data, version=response_data.get("version"))
+
+    @property
+    def version(self):
+        """快照内容的哈希(首次访问时计算)"""
+        if self._version is None:
+            canonical = json.dumps(
+                self.cabinets, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+            )
+            self._version = hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+        return self._version
+
+    def __len__(self):
+        return sum(
+            len(box.get("packages", []))
+            for cabinet in self.cabinets
+            for box in cabinet.get("boxes", [])
+        )
+
+    @property
+    def records(self):
+        """全部包裹(首次访问时规范化并保留)"""
+        if self._records is None:
+            self._records = [record for _, record in self.iter_records()]
+        return self._records
+
+    @property
+    def index(self):
+        """全部包裹的二级索引(首次访问时建立，随快照一起缓存)"""
+        if self._index is None:
+            self._index = OrderIndex(self.records)
+        return self._index
+
+    def iter_records(self, start=(0, 0, 0)):
+        """从start(柜机、箱子、包裹下标)开始，逐个产出 (位置, 包裹)
+
+        生成器只在被取用时才规范化对应的包裹。
+        """
+        first_cabinet, first_box, first_package = start
+        for ci in range(first_cabinet, len(self.cabinets)):
+            cabinet = self.cabinets[ci]
+            cabinet_code = _intern(cabinet.get("cabinetCode", ""))
+            cabinet_address = cabinet.get("address", "")
+            boxes = cabinet.get("boxes", [])
+            for bi in range(first_box if ci == first_cabinet else 0, len(boxes)):
+                box = boxes[bi]
+                box_id = box.get("boxId", "")
+                box_location = box.get("location", "")
+                packages = box.get("packages", [])
+                resume = ci == first_cabinet and bi == first_box
+                for pi in range(first_package if resume else 0, len(packages)):
+                    package = packages[pi]
+                    position = [ci, cabinet_code, bi, box_id, pi, package.get("expressId", "")]
+                    yield position, normalize_pending_package(
+                        package, cabinet_code, cabinet_address, box_id, box_location
+                    )
+
+    def offset_start(self, offset):
+        """第offset个包裹的下标，只统计数量不做规范化"""
+        offset = max(offset, 0)
+        for ci, cabinet in enumerate(self.cabinets):
+            for bi, box in enumerate(cabinet.get("boxes", [])):
+                count = len(box.get("packages", []))
+                if offset < count:
+                    return ci, bi, offset
+                offset -= count
+        return len(self.cabinets), 0, 0
+
+    def cursor_start(self, position):
+        """游标指向的包裹之后的下标，游标不属于该快照时抛出ValueError"""
+        ci, cabinet_code, bi, box_id, pi, express_id = position
+        try:
+            cabinet = self.cabinets[ci]
+            box = cabinet.get("boxes", [])[bi]
+            package = box.get("packages", [])[pi]
+        except IndexError:
+            raise ValueError("cursor does not match snapshot")
+        if (
+            cabinet.get("cabinetCode", "") != cabinet_code
+            or box.get("boxId", "") != box_id
+            or package.get("expressId", "") != express_id
+        ):
+            raise ValueError("cursor does not match snapshot")
+        return ci, bi, pi + 1
+
+    def page(self, start, limit):
+        """从start开始取最多limit个包裹，返回 (包裹列表, 下一页游标或None)"""
+        if limit <= 0:
+            return [], None
+        records = []
+        position = None
+        iterator = self.iter_records(start)
+        for position, record in iterator:
+            records.append(record)
+            if len(records) >= limit:
+                break
+        else:
+            return records, None
+        # 只有后面还有包裹时才返回游标
+        for _ in iterator:
+            return records, encode_cursor([self.version, *position])
+        return records, None
+
+    def cabinet_indexes(self):
+        """有包裹的柜机下标"""
+        return [
+            ci
+            for ci, cabinet in enumerate(self.cabinets)
+            if any(box.get("packages") for box in cabinet.get("boxes", []))
+        ]
+
+    def cabinet_records(self, ci):
+        """规范化单个柜机的全部包裹"""
+        records = []
+        for position, record in self.iter_records((ci, 0, 0)):
+            if position[0] != ci:
+                break
+            records.append(record)
+        return records
+
+
+def normalize_pending_orders(response_data):
+    """展开queryWaitPick的 柜机 -> 箱子 -> 包裹 层级，返回规范化后的包裹列表"""
+    return PendingSnapshot(response_data).records
@@ -0,0 +1,138 @@
+"""待取订单变化推送
+
+同一个Authorization的所有订阅者(多个浏览器标签页)共用一个后台轮询任务。
+轮询任务按expressId对比前后两次的待取快照，只把新增和移除的包裹推送给订阅者；
+连续无变化时逐步拉长轮询间隔，有变化或出错恢复后再缩短。
+"""
+import asyncio
+import os
+
+import metrics
+
+POLL_MIN_INTERVAL = float(os.environ.get("PENDING_POLL_MIN_INTERVAL", "15"))
+POLL_MAX_INTERVAL = float(os.environ.get("PENDING_POLL_MAX_INTERVAL", "120"))
+# 无变化时间隔的增长倍数
+POLL_BACKOFF = 1.5
+# 每个订阅者最多积压的事件数，超过后丢弃新事件
+SUBSCRIBER_QUEUE_SIZE = 100
+# 同时运行的后台轮询任务(即同时订阅的token)上限
+MAX_POLLERS = int(os.environ.get("PENDING_EVENTS_MAX_POLLERS", "200"))
+
+
+class TooManyPollers(Exception):
+    """轮询任务数已达上限，无法为新的token开始轮询"""
+
+
+def diff_snapshots(previous, current):
+    """按expressId对比两次快照，返回 (新增的包裹列表, 移除的expressId列表)"""
+    previous_ids = {order.expressId for order in previous}
+    current_ids = {order.expressId for order in current}
+    added = [order for order in current if order.expressId not in previous_ids]
+    removed = [order.expressId for order in previous if order.expressId not in current_ids]
+    return added, removed
+
+
+class PendingPoller:
+    """单个token的后台轮询任务"""
+
+    def __init__(self, authorization, fetch):
+        self.authorization = authorization
+        self.fetch = fetch
+        self.subscribers = set()
+        self.snapshot = None
+        self.interval = POLL_MIN_INTERVAL
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, event, data):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                pass
+
+    async def _run(self):
+        # 轮询任务由订阅请求创建，之后的耗时不应计入该请求的接口
+        metrics.detach_request()
+        while True:
+            try:
+                current = await self.fetch(self.authorization)
+            except Exception as e:
+                self.publish("error", {"message": str(e)})
+                self.interval = min(self.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+            else:
+                if self.snapshot is None:
+                    self.publish("snapshot", {"data": [order.to_dict() for order in current]})
+                    self.interval = POLL_MIN_INTERVAL
+                else:
+                    added, removed = diff_snapshots(self.snapshot, current)
+                    if added or removed:
+                        self.publish(
+                            "change",
+                            {"added": [order.to_dict() for order in added], "removed": removed},
+                        )
+                        self.interval = POLL_MIN_INTERVAL
+                    else:
+                        self.interval = min(self.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+                self.snapshot = current
+            await asyncio.sleep(self.interval)
+
+
+class PendingEventHub:
+    """按token管理轮询任务和订阅者"""
+
+    def __init__(self, fetch, max_pollers=None):
+        self.fetch = fetch
+        self.max_pollers = MAX_POLLERS if max_pollers is None else max_pollers
+        self._pollers = {}
+
+    def subscribe(self, authorization):
+        """订阅某个token的待取变化，返回接收 (事件名, 数据) 的队列
+
+        需要新开轮询任务而任务数已达上限时抛出TooManyPollers。
+        """
+        poller = self._pollers.get(authorization)
+        if poller is None:
+            if len(self._pollers) >= self.max_pollers:
+                raise TooManyPollers()
+            poller = PendingPoller(authorization, self.fetch)
+            self._pollers[authorization] = poller
+            poller.start()
+
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if poller.snapshot is not None:
+            # 轮询任务已经在运行，新订阅者先收到当前的完整快照
+            queue.put_nowait(
+                ("snapshot", {"data": [order.to_dict() for order in poller.snapshot]})
+            )
+        poller.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, authorization, queue):
+        """取消订阅，最后一个订阅者离开时停止该token的轮询"""
+        poller = self._pollers.get(authorization)
+        if poller is None:
+            return
+        poller.subscribers.discard(queue)
+        if not poller.subscribers:
+            poller.stop()
+            del self._pollers[authorization]
+
+    def close(self):
+        for poller in self._pollers.values():
+            poller.stop()
+        self._pollers.clear()
+
+    def stats(self):
+        return {
+            "pollers": len(self._pollers),
+            "max_pollers": self.max_pollers,
+            "subscribers": sum(len(p.subscribers) for p in self._pollers.values()),
+        }
@@ -0,0 +1,110 @@
+"""已取订单的预读
+
+返回第N页后，在后台提前请求第N+1页并暂存。用户滚动到底部加载下一页时直接使用
+暂存的结果(或等待进行中的请求)，省去一次等待丰巢的往返。
+
+每个token只暂存一页，条目在 ttl 秒后过期，token数量超过 maxsize 时淘汰最久
+未使用的条目。未被使用就被替换、过期或淘汰的预读计为 wasted。
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class PagePrefetcher:
+    def __init__(self, fetch, ttl, maxsize=256):
+        self.fetch = fetch  # async (authorization, page, limit) -> 结果
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # token -> (过期时间, page, limit, 预读任务)
+        self.issued = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, entry):
+        """丢弃未被使用的预读"""
+        task = entry[3]
+        if not task.done():
+            task.cancel()
+        self.wasted += 1
+
+    def take(self, authorization, page, limit):
+        """取出该token预读的页面任务，没有对应的预读时返回None"""
+        entry = self._entries.pop(authorization, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, entry_page, entry_limit, task = entry
+        if expires_at <= time.monotonic() or (entry_page, entry_limit) != (page, limit):
+            self._discard(entry)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return task
+
+    async def get(self, authorization, page, limit):
+        """优先使用预读结果，没有预读或预读失败时直接请求"""
+        task = self.take(authorization, page, limit) if self.enabled else None
+        if task is not None:
+            try:
+                return await asyncio.shield(task)
+            except Exception:
+                pass
+        return await self.fetch(authorization, page, limit)
+
+    def schedule(self, authorization, page, limit):
+        """在后台预读指定页"""
+        if not self.enabled:
+            return
+        previous = self._entries.pop(authorization, None)
+        if previous is not None:
+            self._discard(previous)
+
+        task = asyncio.ensure_future(self._run(authorization, page, limit))
+        task.add_done_callback(_consume_exception)
+        self.issued += 1
+        self._entries[authorization] = (time.monotonic() + self.ttl, page, limit, task)
+        while len(self._entries) > self.maxsize:
+            _, evicted = self._entries.popitem(last=False)
+            self._discard(evicted)
+
+    async def _run(self, authorization, page, limit):
+        metrics.detach_request()
+        return await self.fetch(authorization, page, limit)
+
+    def clear(self):
+        for entry in self._entries.values():
+            self._discard(entry)
+        self._entries.clear()
+
+    def stats(self):
+        # 已过期但还未被访问到的条目也算作浪费
+        now = time.monotonic()
+        expired = sum(1 for entry in self._entries.values() if entry[0] <= now)
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "issued": self.issued,
+            "hits": self.hits,
+            "misses": self.misses,
+            "wasted": self.wasted + expired,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def _consume_exception(task):
+    # 预读失败时由 get 回退到直接请求，这里只避免"exception was never retrieved"的警告
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,89 @@
+"""按需采样的性能剖析
+
+后台线程每隔 interval 秒读取一次所有线程的调用栈(sys._current_frames)，
+按调用栈累计采样次数，输出 flamegraph.pl / speedscope 可以直接读取的折叠格式:
+每行 "线程名;外层函数;...;内层函数 采样次数"。
+
+采样不需要修改业务代码，也不依赖第三方库，开销只和采样频率有关。
+同一时间只允许一个剖析任务。
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# 采样间隔(秒)
+SAMPLE_INTERVAL = 0.005
+# 调用栈最多保留的层数
+MAX_DEPTH = 128
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """已经有剖析任务在运行"""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not _lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        _lock.release()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def folded(self):
+        """折叠格式的剖析结果"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+async def profile(seconds, until=None):
+    """剖析接下来的 seconds 秒
+
+    until 为可选的无参函数，返回True时提前结束(例如已处理完N个请求)。
+    """
+    profiler = SamplingProfiler()
+    profiler.start()
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            if until is not None and until():
+                break
+            await asyncio.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    return profiler
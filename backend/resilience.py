@@ -0,0 +1,76 @@
+"""上游调用的容错工具: 熔断器、退避延迟和延迟分位统计"""
+import random
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，熔断期间直接拒绝请求
+
+    熔断 reset_timeout 秒后进入半开状态，放行一个探测请求: 成功则恢复，
+    失败则继续熔断。探测请求没有返回结果(例如被取消)时，
+    再过 reset_timeout 秒会放行下一个探测请求。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change  # 状态变化时回调 on_change(新状态)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            if self.on_change is not None:
+                self.on_change(state)
+
+    def allow(self):
+        """是否放行本次请求"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self.reset_timeout:
+            return False
+        # 放行一个探测请求，同一窗口内的其他请求继续被拒绝
+        self._opened_at = now
+        self._set_state(self.HALF_OPEN)
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+def backoff_delay(attempt, base, cap):
+    """第attempt次重试前的等待时间(full jitter)，attempt从0开始"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class LatencyWindow:
+    """最近若干次成功请求的耗时，用于估算分位数"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def add(self, duration):
+        self._samples.append(duration)
+
+    def quantile(self, q):
+        """样本不足时返回None"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
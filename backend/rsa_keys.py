@@ -0,0 +1,146 @@
+"""RSA公钥解析缓存与加密
+
+丰巢下发的公钥格式不固定，解析时需要依次尝试多种方式。这里把解析结果
+(密钥对象以及成功的解析方式)按公钥字符串缓存在一个有界LRU中，同一个公钥
+重复登录或重试时不再重新解析；加密本身放到线程池中执行，不占用事件循环。
+"""
+import asyncio
+import base64
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Crypto.Cipher import PKCS1_v1_5
+from Crypto.PublicKey import RSA
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+import metrics
+from structured_log import log
+
+# 缓存的公钥数量上限
+KEY_CACHE_SIZE = int(os.environ.get("RSA_KEY_CACHE_SIZE", "128"))
+# 执行RSA加密的线程数
+RSA_WORKERS = int(os.environ.get("RSA_WORKERS", "4"))
+
+# 解析方式
+STRATEGY_RAW = "raw"  # 直接导入
+STRATEGY_PEM = "pem"  # 补全PEM头尾后导入
+STRATEGY_DER = "der"  # base64解码后按DER格式交给cryptography加载
+
+_key_cache = OrderedDict()
+_key_cache_lock = threading.Lock()
+_executor = None
+
+
+def format_rsa_key(key_data):
+    """格式化RSA密钥为PEM格式"""
+    # 去除可能的头尾部分
+    key_data = key_data.strip()
+
+    # 如果已经是PEM格式，直接返回
+    if key_data.startswith("-----BEGIN"):
+        return key_data
+
+    # 否则添加PEM头尾
+    return f"-----BEGIN PUBLIC KEY-----\n{key_data}\n-----END PUBLIC KEY-----"
+
+
+def parse_rsa_key(key_string):
+    """解析RSA公钥，返回 (解析方式, 密钥对象)，不经过缓存"""
+    try:
+        # 尝试标准PEM格式导入
+        return STRATEGY_RAW, RSA.importKey(key_string)
+    except ValueError:
+        try:
+            # 尝试格式化后再导入
+            return STRATEGY_PEM, RSA.importKey(format_rsa_key(key_string))
+        except Exception as e:
+            # 如果还是失败，尝试直接使用base64解码的数据
+            # 这是一个备选方案，因为原始代码可能使用了特殊方式处理公钥
+            try:
+                key_bytes = base64.b64decode(key_string)
+                public_key = serialization.load_der_public_key(
+                    key_bytes, backend=default_backend()
+                )
+                return STRATEGY_DER, public_key
+            except Exception:
+                # 如果所有尝试都失败，记录详细错误并重新抛出原始异常
+                log.error("rsa.parse_failed", key_prefix=key_string[:30])
+                raise e
+
+
+def load_rsa_key(key_string):
+    """从LRU缓存中获取已解析的公钥，未命中时解析并写入缓存"""
+    with _key_cache_lock:
+        entry = _key_cache.get(key_string)
+        if entry is not None:
+            _key_cache.move_to_end(key_string)
+            return entry
+
+    # 解析放在锁外，避免阻塞其他线程的缓存读取
+    entry = parse_rsa_key(key_string)
+
+    with _key_cache_lock:
+        _key_cache[key_string] = entry
+        _key_cache.move_to_end(key_string)
+        while len(_key_cache) > KEY_CACHE_SIZE:
+            _key_cache.popitem(last=False)
+    return entry
+
+
+def clear_key_cache():
+    with _key_cache_lock:
+        _key_cache.clear()
+
+
+def encrypt_with_key(data, strategy, key):
+    """使用已解析的公钥加密数据"""
+    if strategy == STRATEGY_DER:
+        return key.encrypt(data.encode(), padding.PKCS1v15())
+    # 使用PKCS1_v1_5进行加密
+    return PKCS1_v1_5.new(key).encrypt(data.encode())
+
+
+def encrypt_with_rsa(data, key_string):
+    """使用RSA公钥加密数据"""
+    strategy, key = load_rsa_key(key_string)
+    return encrypt_with_key(data, strategy, key)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=RSA_WORKERS, thread_name_prefix="rsa")
+    return _executor
+
+
+async def load_rsa_key_async(key_string):
+    """在线程池中获取已解析的公钥，返回 (解析方式, 密钥对象)"""
+    loop = asyncio.get_running_loop()
+    with metrics.phase("rsa"):
+        return await loop.run_in_executor(_get_executor(), load_rsa_key, key_string)
+
+
+async def encrypt_with_key_async(data, strategy, key):
+    """在线程池中使用已解析的公钥加密"""
+    loop = asyncio.get_running_loop()
+    with metrics.phase("rsa"):
+        return await loop.run_in_executor(_get_executor(), encrypt_with_key, data, strategy, key)
+
+
+async def encrypt_with_rsa_async(data, key_string):
+    """在线程池中执行RSA加密，避免占用事件循环"""
+    loop = asyncio.get_running_loop()
+    with metrics.phase("rsa"):
+        return await loop.run_in_executor(_get_executor(), encrypt_with_rsa, data, key_string)
+
+
+def shutdown():
+    """释放加密线程池"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,82 @@
+"""生产环境启动入口
+
+启动多个worker进程(预先fork，共同监听同一端口)，不开启自动重载:
+
+    python serve.py --workers 4 --port 5000
+
+- 安装了 uvloop / httptools 时自动使用(pip install uvloop httptools)，否则使用标准事件循环和h11
+- 收到 SIGTERM/SIGINT 后停止接受新连接，等待进行中的请求完成(最长 --graceful-timeout 秒)再退出
+- 多于一个worker时，未配置 SHARED_CACHE_PATH 则在临时目录下新建仅当前用户可访问的
+  私有目录存放共享缓存文件(退出时删除)，待取快照和柜机布局缓存在各worker之间保持一致；
+  缓存值以明文保存，自行指定 SHARED_CACHE_PATH 时也应放在私有目录中
+- 多于一个worker时，未配置 PENDING_EVENTS_TICKET_SECRET 则随机生成，各worker都能解开
+  其他worker签发的推送票据
+"""
+import argparse
+import inspect
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _available(module):
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以生产模式启动后端")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30.0,
+        help="关闭时等待进行中请求的最长秒数",
+    )
+    parser.add_argument("--no-uvloop", action="store_true", help="不使用uvloop/httptools")
+    args = parser.parse_args()
+
+    cache_dir = None
+    if args.workers > 1 and not os.environ.get("SHARED_CACHE_PATH"):
+        # mkdtemp创建的目录权限为0700；worker进程继承环境变量，都会打开同一个共享缓存文件
+        cache_dir = tempfile.mkdtemp(prefix=f"fengchao-cache-{args.port}-")
+        os.environ["SHARED_CACHE_PATH"] = os.path.join(cache_dir, "cache.db")
+    if args.workers > 1 and not os.environ.get("PENDING_EVENTS_TICKET_SECRET"):
+        os.environ["PENDING_EVENTS_TICKET_SECRET"] = secrets.token_urlsafe(32)
+
+    fast = not args.no_uvloop
+    options = {
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "loop": "uvloop" if fast and _available("uvloop") else "asyncio",
+        "http": "httptools" if fast and _available("httptools") else "h11",
+        "proxy_headers": True,
+    }
+    # 较老的uvicorn没有该参数，仍会等待连接结束，只是没有超时
+    if "timeout_graceful_shutdown" in inspect.signature(uvicorn.Config).parameters:
+        options["timeout_graceful_shutdown"] = args.graceful_timeout
+
+    sys.path.insert(0, BACKEND_DIR)
+    try:
+        uvicorn.run("app:app", **options)
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
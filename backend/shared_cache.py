@@ -0,0 +1,201 @@
+"""多个worker进程共享的缓存存储(SQLite)
+
+生产模式下多个worker各自有一份进程内缓存，互相看不到对方的写入和失效。
+配置 SHARED_CACHE_PATH 后，TTLCache 把缓存值同时写入这个本机SQLite文件，
+每个worker读取时先用版本号核对，本地副本过期、被其他worker失效或更新时
+从共享存储重新读取，各worker看到的缓存保持一致。
+
+键在落盘前做哈希，不在文件中保存token原文；缓存值(待取快照中的取件码、手机号等)
+以明文保存，文件只允许当前用户读写，应放在私有目录中。
+
+读写直接在事件循环中同步执行，等待其他worker释放写锁最多 BUSY_TIMEOUT 秒。
+共享存储被锁或出错时不抛出异常，TTLCache 退回只使用进程内缓存。
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from structured_log import log
+
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "")
+
+# 等待其他worker释放写锁的最长时间(秒)，在事件循环中同步等待，必须很短
+BUSY_TIMEOUT = float(os.environ.get("SHARED_CACHE_BUSY_TIMEOUT", "0.005"))
+
+# 每写入多少次清理一次过期条目
+PURGE_EVERY = 200
+
+# 共享存储暂时不可用时 SharedNamespace.version/get 的返回值
+UNAVAILABLE = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at);
+"""
+
+
+def _hash_key(key):
+    return hashlib.sha256(str(key).encode()).hexdigest()
+
+
+class SharedStore:
+    """共享缓存文件，同一进程内的各个命名空间共用一个连接"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        # 先以0600创建文件，SQLite的-wal/-shm文件沿用数据库文件的权限
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        self._conn = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def version(self, namespace, key):
+        """返回未过期条目的版本号，不存在或已过期时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, _hash_key(key), time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, namespace, key):
+        """返回 (版本号, 剩余有效期, 值)，不存在或已过期时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, expires_at, value FROM cache "
+                "WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, _hash_key(key), time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        version, expires_at, value = row
+        return version, expires_at - time.time(), value
+
+    def set(self, namespace, key, value, ttl):
+        """写入并返回新的版本号"""
+        version = secrets.randbits(62)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, version, expires_at, value) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, _hash_key(key), version, now + ttl, value),
+            )
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        return version
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, _hash_key(key))
+            )
+
+    def clear(self, namespace):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedNamespace:
+    """共享存储中的一个命名空间，负责值的序列化
+
+    SQLite出错(包括等待写锁超时)时记录警告，version/get 返回 UNAVAILABLE，
+    set 返回None，delete/clear 忽略。
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    @property
+    def store(self):
+        return get_store()
+
+    def _failed(self, operation, error):
+        log.warning("shared_cache.unavailable", namespace=self.name, op=operation, error=str(error))
+
+    def version(self, key):
+        try:
+            return self.store.version(self.name, key)
+        except sqlite3.Error as e:
+            self._failed("version", e)
+            return UNAVAILABLE
+
+    def get(self, key):
+        """返回 (版本号, 剩余有效期, 值)，不存在时返回None，不可用时返回UNAVAILABLE"""
+        try:
+            entry = self.store.get(self.name, key)
+        except sqlite3.Error as e:
+            self._failed("get", e)
+            return UNAVAILABLE
+        if entry is None:
+            return None
+        version, ttl, raw = entry
+        return version, ttl, self.loads(raw)
+
+    def set(self, key, value, ttl):
+        """写入并返回新的版本号，写入失败时返回None"""
+        try:
+            return self.store.set(self.name, key, self.dumps(value), ttl)
+        except sqlite3.Error as e:
+            self._failed("set", e)
+            return None
+
+    def delete(self, key):
+        try:
+            self.store.delete(self.name, key)
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def clear(self):
+        try:
+            self.store.clear(self.name)
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+
+
+_store = None
+
+
+def get_store():
+    """返回共享缓存文件，首次使用(或关闭后再次使用)时打开"""
+    global _store
+    if _store is None:
+        _store = SharedStore(SHARED_CACHE_PATH)
+    return _store
+
+
+def namespace(name, dumps, loads):
+    """返回共享缓存的命名空间，未配置 SHARED_CACHE_PATH 时返回None(只使用进程内缓存)"""
+    if not SHARED_CACHE_PATH:
+        return None
+    return SharedNamespace(name, dumps, loads)
+
+
+def shutdown():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,187 @@
+"""结构化JSON日志
+
+日志记录只是把事件放进队列，格式化(脱敏、截断、JSON序列化)和写出都在后台线程中
+完成，接口处理过程不会因为写日志而阻塞。支持级别控制、按事件采样，以及对token、
+签名、验证码、手机号等敏感字段的脱敏。
+
+环境变量:
+    LOG_LEVEL          日志级别，默认 INFO
+    LOG_SAMPLE_RATES   按事件设置采样率，例如 "pending_orders.upstream_response=0.01,login.response=0.1"
+    LOG_MAX_STRING     单个字符串的最大长度，默认 200
+    LOG_MAX_ITEMS      列表/字典的最大元素数，默认 20
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from collections.abc import Mapping
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MAX_STRING = int(os.environ.get("LOG_MAX_STRING", "200"))
+LOG_MAX_ITEMS = int(os.environ.get("LOG_MAX_ITEMS", "20"))
+LOG_MAX_DEPTH = 6
+LOG_QUEUE_SIZE = 10000
+
+# 值会被整体替换的字段(不区分大小写)
+REDACT_KEYS = {
+    "authorization",
+    "token",
+    "sign",
+    "verifycode",
+    "verificationcode",
+    "fc_user_auth",
+    "cookie",
+    "set-cookie",
+    "pickupcode",
+    "code",  # 上游包裹数据中的取件码
+    "rsa_public_key",
+    "rsapublickey",
+}
+# 字段名包含这些词时按手机号打码
+MASK_KEY_PARTS = ("mobile", "phone")
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            event, rate = item.split("=", 1)
+            try:
+                rates[event.strip()] = float(rate)
+            except ValueError:
+                pass
+    return rates
+
+
+SAMPLE_RATES = _parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+
+def mask_phone(value):
+    value = str(value)
+    if len(value) >= 7:
+        return value[:3] + "****" + value[-4:]
+    return "****"
+
+
+def sanitize(value, key=None, depth=0):
+    """脱敏并截断日志字段"""
+    if key is not None:
+        lowered = str(key).lower()
+        if lowered in REDACT_KEYS:
+            return "***"
+        if isinstance(value, (str, int)) and any(part in lowered for part in MASK_KEY_PARTS):
+            return mask_phone(value)
+
+    if depth >= LOG_MAX_DEPTH:
+        return "..."
+    if isinstance(value, Mapping):
+        items = list(value.items())
+        result = {str(k): sanitize(v, k, depth + 1) for k, v in items[:LOG_MAX_ITEMS]}
+        if len(items) > LOG_MAX_ITEMS:
+            result["..."] = f"共{len(items)}项"
+        return result
+    if isinstance(value, (list, tuple)):
+        result = [sanitize(v, None, depth + 1) for v in value[:LOG_MAX_ITEMS]]
+        if len(value) > LOG_MAX_ITEMS:
+            result.append(f"...共{len(value)}项")
+        return result
+    if isinstance(value, str):
+        if len(value) > LOG_MAX_STRING:
+            return value[:LOG_MAX_STRING] + f"...(共{len(value)}字符)"
+        return value
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return sanitize(str(value), None, depth)
+
+
+class JSONFormatter(logging.Formatter):
+    """在后台线程中把日志事件格式化为一行JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(sanitize(fields))
+        if record.exc_info:
+            entry["exc"] = sanitize(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞，并记录丢弃数量"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 格式化推迟到后台线程，这里只传递原始记录
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    def __init__(self, name="fengchao"):
+        self._logger = logging.getLogger(name)
+        self._logger.propagate = False
+        self._logger.setLevel(LOG_LEVEL)
+        self._queue = queue.Queue(LOG_QUEUE_SIZE)
+        self._handler = DroppingQueueHandler(self._queue)
+        self._logger.addHandler(self._handler)
+
+        writer = logging.StreamHandler(sys.stdout)
+        writer.setFormatter(JSONFormatter())
+        self._listener = logging.handlers.QueueListener(self._queue, writer)
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self._listener.start()
+            self._started = True
+
+    def stop(self):
+        """停止后台线程，退出前会写完队列中剩余的日志"""
+        if self._started:
+            self._listener.stop()
+            self._started = False
+
+    @property
+    def dropped(self):
+        return self._handler.dropped
+
+    def _log(self, level, event, sample, fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        rate = SAMPLE_RATES.get(event, sample)
+        if rate is not None and rate < 1 and random.random() >= rate:
+            return
+        if not self._started:
+            self.start()
+        self._logger.log(level, event, extra={"fields": fields})
+
+    def debug(self, event, sample=None, **fields):
+        self._log(logging.DEBUG, event, sample, fields)
+
+    def info(self, event, sample=None, **fields):
+        self._log(logging.INFO, event, sample, fields)
+
+    def warning(self, event, sample=None, **fields):
+        self._log(logging.WARNING, event, sample, fields)
+
+    def error(self, event, sample=None, **fields):
+        self._log(logging.ERROR, event, sample, fields)
+
+
+log = StructuredLogger()
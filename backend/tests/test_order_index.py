@@ -0,0 +1,35 @@
+from orders import OrderIndex, OrderRecord
+
+
+def make_records():
+    return [
+        OrderRecord(expressId="a", companyName="SF", boxName="C1", sendTm="2024-01-02"),
+        OrderRecord(expressId="b", companyName="YT", boxName="C1", sendTm=None, totalCustodyFee="1.5"),
+        OrderRecord(expressId="c", companyName="SF", boxName="C2", sendTm="2024-01-03", pickTm=None),
+        OrderRecord(expressId="d", companyName="SF", boxName="C1", sendTm="2024-01-01"),
+    ]
+
+
+def express_ids(index, rows):
+    return [record.expressId for record in index.take(rows)]
+
+
+def test_null_sort_values_sort_first_ascending():
+    index = OrderIndex(make_records())
+    assert express_ids(index, index.select(sort="sendTm", descending=False)) == ["b", "d", "a", "c"]
+    assert express_ids(index, index.select(sort="pickTm")) == ["d", "c", "b", "a"]
+
+
+def test_filters_intersect_and_keep_order():
+    index = OrderIndex(make_records())
+    rows = index.select(filters={"companyName": "SF", "boxName": "C1", "pickStatus": None})
+    assert express_ids(index, rows) == ["a", "d"]
+    rows = index.select(filters={"companyName": "SF", "boxName": "C1"}, sort="sendTm")
+    assert express_ids(index, rows) == ["a", "d"]
+    assert index.select(filters={"companyName": "JD"}) == []
+
+
+def test_custody_fee_filter():
+    index = OrderIndex(make_records())
+    assert express_ids(index, index.select(custody_fee=True)) == ["b"]
+    assert express_ids(index, index.select(custody_fee=False)) == ["a", "c", "d"]
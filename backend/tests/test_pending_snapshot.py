@@ -0,0 +1,126 @@
+import pytest
+
+from orders import PendingSnapshot, decode_cursor
+
+
+def make_response(cabinet_codes, boxes=2, packages=2):
+    cabinets = [
+        {
+            "cabinetCode": code,
+            "address": f"{code}-addr",
+            "boxes": [
+                {
+                    "boxId": f"{code}{b}",
+                    "location": "L",
+                    "packages": [{"expressId": f"{code}{b}-{p}"} for p in range(packages)],
+                }
+                for b in range(boxes)
+            ],
+        }
+        for code in cabinet_codes
+    ]
+    return {"success": True, "data": {"cabinets": cabinets}}
+
+
+def express_ids(records):
+    return [record.expressId for record in records]
+
+
+def read_all(snapshot, limit):
+    """按游标一直翻到最后一页"""
+    records, cursor = snapshot.page(snapshot.offset_start(0), limit)
+    pages = [express_ids(records)]
+    while cursor is not None:
+        version, position = decode_cursor(cursor)
+        assert version == snapshot.version
+        records, cursor = snapshot.page(snapshot.cursor_start(position), limit)
+        pages.append(express_ids(records))
+    return pages
+
+
+def test_cursor_pages_cover_every_package_once():
+    snapshot = PendingSnapshot(make_response("ABC"))
+    pages = read_all(snapshot, 5)
+    flat = [express_id for page in pages for express_id in page]
+    assert flat == express_ids(snapshot.records)
+    assert [len(page) for page in pages] == [5, 5, 2]
+
+
+def test_last_page_has_no_cursor():
+    snapshot = PendingSnapshot(make_response("A"))
+    records, cursor = snapshot.page(snapshot.offset_start(0), 4)
+    assert len(records) == 4
+    assert cursor is None
+
+
+def test_cursor_continues_in_issuing_snapshot_after_removals():
+    # 第一页停在B柜机的最后一个包裹，随后A、B柜机的包裹全部被取走
+    first = PendingSnapshot(make_response("ABCD"))
+    records, cursor = first.page(first.offset_start(0), 8)
+    assert express_ids(records)[-1] == "B1-1"
+    refreshed = PendingSnapshot(make_response("CD"))
+
+    version, position = decode_cursor(cursor)
+    assert version == first.version != refreshed.version
+    with pytest.raises(ValueError):
+        refreshed.cursor_start(position)
+
+    records, _ = first.page(first.cursor_start(position), 4)
+    assert express_ids(records) == ["C0-0", "C0-1", "C1-0", "C1-1"]
+
+
+@pytest.mark.parametrize(
+    "remaining",
+    [
+        # 同一柜机中游标之前的箱子被取空
+        [{"boxId": "A1", "packages": [{"expressId": "A1-0"}]}],
+        # 同一箱子中游标之前的包裹被取走
+        [{"boxId": "A0", "packages": [{"expressId": "A0-1"}]}],
+    ],
+)
+def test_cursor_rejected_by_snapshot_with_removed_siblings(remaining):
+    first = PendingSnapshot(make_response("A"))
+    _, cursor = first.page(first.offset_start(0), 1)
+    _, position = decode_cursor(cursor)
+    refreshed = PendingSnapshot(
+        {"success": True, "data": {"cabinets": [{"cabinetCode": "A", "boxes": remaining}]}}
+    )
+    with pytest.raises(ValueError):
+        refreshed.cursor_start(position)
+    records, _ = first.page(first.cursor_start(position), 10)
+    assert express_ids(records) == ["A0-1", "A1-0", "A1-1"]
+
+
+def test_identical_snapshots_issue_identical_cursors():
+    first = PendingSnapshot(make_response("ABC"))
+    second = PendingSnapshot(make_response("ABC"))
+    assert first.version == second.version
+    assert first.page(first.offset_start(0), 3)[1] == second.page(second.offset_start(0), 3)[1]
+    assert PendingSnapshot(make_response("AB")).version != first.version
+
+
+def test_snapshot_version_survives_serialization():
+    snapshot = PendingSnapshot(make_response("AB"))
+    restored = PendingSnapshot.from_json(snapshot.to_json())
+    assert restored.version == snapshot.version
+    _, cursor = snapshot.page(snapshot.offset_start(0), 3)
+    _, position = decode_cursor(cursor)
+    assert restored.cursor_start(position) == snapshot.cursor_start(position)
+
+
+def test_non_positive_limit_and_negative_offset():
+    snapshot = PendingSnapshot(make_response("AB"))
+    assert snapshot.page(snapshot.offset_start(0), 0) == ([], None)
+    assert snapshot.offset_start(-4) == (0, 0, 0)
+    records, _ = snapshot.page(snapshot.offset_start(-4), 2)
+    assert express_ids(records) == ["A0-0", "A0-1"]
+
+
+def test_offset_past_the_end_returns_empty_page():
+    snapshot = PendingSnapshot(make_response("A"))
+    assert snapshot.page(snapshot.offset_start(100), 10) == ([], None)
+
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
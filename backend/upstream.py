@@ -0,0 +1,287 @@
+"""丰巢上游接口的共享异步客户端
+
+所有对 consumer.fcbox.com 的请求都经过这里，复用同一个带连接池的
+httpx.AsyncClient，避免每次请求都重新建立 TCP+TLS 连接，也不会阻塞事件循环。
+
+容错策略:
+- 每个接口有单次请求的超时；只读接口另有包含重试在内的总时限
+- 只读接口(queryWaitPick、pageQuery4App、cabinetVisualInfo)在连接错误、超时或
+  5xx时按带随机抖动的指数退避重试；openBox、登录和发送验证码从不重试
+- 每个接口一个熔断器，连续失败后一段时间内直接失败，不再等待上游
+- 可选对冲: 只读接口超过近期p95耗时仍未返回时再发一个相同请求，取先返回的结果
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+import httpx
+
+import fast_json
+import metrics
+from resilience import CircuitBreaker, LatencyWindow, backoff_delay
+
+# 丰巢接口地址，压测时可指向本地的模拟服务(benchmarks/fake_fcbox.py)
+FCBOX_BASE_URL = os.environ.get("FCBOX_BASE_URL", "https://consumer.fcbox.com").rstrip("/")
+
+# 连接池配置，可通过环境变量调整
+MAX_CONNECTIONS = int(os.environ.get("FCBOX_MAX_CONNECTIONS", "200"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("FCBOX_MAX_KEEPALIVE_CONNECTIONS", "50"))
+KEEPALIVE_EXPIRY = float(os.environ.get("FCBOX_KEEPALIVE_EXPIRY", "30"))
+
+# 建立连接的超时时间(秒)
+CONNECT_TIMEOUT = 5.0
+# 未单独配置的接口使用的默认超时时间(秒)
+DEFAULT_TIMEOUT = 10.0
+
+# 各上游接口的超时时间(秒)，按URL路径最后一段匹配
+ENDPOINT_TIMEOUTS = {
+    "secureCheckMobile": 8.0,
+    "secureSendCode": 8.0,
+    "secureLoginByPhone": 10.0,
+    "pageQuery4App": 10.0,
+    "queryWaitPick": 10.0,
+    "cabinetVisualInfo": 8.0,
+    "openBox": 15.0,
+}
+
+# 可以安全重试和对冲的只读接口
+IDEMPOTENT_ENDPOINTS = frozenset({"queryWaitPick", "pageQuery4App", "cabinetVisualInfo"})
+
+# 只读接口包含重试在内的总时限(秒)
+ENDPOINT_DEADLINES = {
+    "pageQuery4App": 15.0,
+    "queryWaitPick": 15.0,
+    "cabinetVisualInfo": 12.0,
+}
+
+# 只读接口的最大重试次数和退避参数(秒)
+RETRY_ATTEMPTS = int(os.environ.get("FCBOX_RETRY_ATTEMPTS", "2"))
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 2.0
+# 需要重试的响应状态码
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# 连续失败多少次后熔断，以及熔断持续的时间(秒)
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("FCBOX_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("FCBOX_CIRCUIT_RESET", "30"))
+
+# 对冲请求，默认关闭；开启后在耗时超过近期p95时发出
+HEDGE_ENABLED = os.environ.get("FCBOX_HEDGE", "").lower() in ("1", "true", "yes")
+HEDGE_QUANTILE = 0.95
+
+_client: Optional[httpx.AsyncClient] = None
+_breakers = {}
+_latencies = {}
+
+
+def endpoint_name(url):
+    """从URL中提取上游接口名，例如 .../clientGet/openBox -> openBox"""
+    return httpx.URL(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def endpoint_timeout(endpoint):
+    """返回指定上游接口的超时配置"""
+    total = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+    return httpx.Timeout(total, connect=min(CONNECT_TIMEOUT, total))
+
+
+def _create_client():
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+
+async def startup():
+    """应用启动时创建共享客户端"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+
+
+async def shutdown():
+    """应用关闭时释放连接池"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client():
+    """获取共享客户端，未经过启动钩子时(如脚本中直接调用)按需创建"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+def get_breaker(api):
+    breaker = _breakers.get(api)
+    if breaker is None:
+        breaker = _breakers[api] = CircuitBreaker(
+            CIRCUIT_FAILURE_THRESHOLD,
+            CIRCUIT_RESET_TIMEOUT,
+            on_change=lambda state: metrics.UPSTREAM_CIRCUIT_OPEN.set(
+                api, value=int(state == CircuitBreaker.OPEN)
+            ),
+        )
+    return breaker
+
+
+def _latency_window(api):
+    window = _latencies.get(api)
+    if window is None:
+        window = _latencies[api] = LatencyWindow()
+    return window
+
+
+async def _send(method, url, api, **kwargs):
+    """发送一次请求并记录指标"""
+    metrics.UPSTREAM_IN_FLIGHT.inc(api)
+    status = "error"
+    start = time.perf_counter()
+    try:
+        response = await get_client().request(method, url, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        duration = time.perf_counter() - start
+        metrics.UPSTREAM_IN_FLIGHT.dec(api)
+        metrics.UPSTREAM_REQUESTS.inc(api, status)
+        metrics.UPSTREAM_LATENCY.observe(api, value=duration)
+        metrics.record_phase("upstream", duration)
+        if status != "error":
+            _latency_window(api).add(duration)
+
+
+async def _send_hedged(method, url, api, **kwargs):
+    """超过近期p95仍未返回时再发一个相同的请求，取先成功返回的结果"""
+    delay = _latency_window(api).quantile(HEDGE_QUANTILE)
+    timeout = kwargs["timeout"].read
+    if delay is None or delay >= timeout:
+        return await _send(method, url, api, **kwargs)
+
+    primary = asyncio.ensure_future(_send(method, url, api, **kwargs))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    metrics.UPSTREAM_HEDGES.inc(api)
+    pending = {primary, asyncio.ensure_future(_send(method, url, api, **kwargs))}
+    fallback = None
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif task.result().status_code in RETRY_STATUSES:
+                    fallback = task.result()
+                else:
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    if fallback is not None:
+        return fallback
+    raise error
+
+
+async def _request_once(method, url, api, breaker, **kwargs):
+    """非幂等接口: 只发送一次"""
+    try:
+        response = await _send(method, url, api, **kwargs)
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+async def _request_with_retry(method, url, api, breaker, **kwargs):
+    """只读接口: 在总时限内重试，每次请求的超时不超过剩余时间"""
+    deadline = time.monotonic() + ENDPOINT_DEADLINES.get(api, DEFAULT_TIMEOUT)
+    timeout = httpx.Timeout(kwargs.pop("timeout"))
+    send = _send_hedged if HEDGE_ENABLED else _send
+    response = None
+    error = None
+
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        if attempt:
+            delay = backoff_delay(attempt - 1, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+            if time.monotonic() + delay >= deadline or not breaker.allow():
+                break
+            metrics.UPSTREAM_RETRIES.inc(api)
+            await asyncio.sleep(delay)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        attempt_timeout = httpx.Timeout(
+            min(timeout.read, remaining), connect=min(timeout.connect, remaining)
+        )
+        try:
+            response = await send(method, url, api, timeout=attempt_timeout, **kwargs)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            error = e
+            continue
+        if response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+
+    # 重试用尽: 有响应时返回最后一次响应，由调用方按状态码处理
+    if response is not None:
+        return response
+    if error is not None:
+        raise error
+    raise httpx.TimeoutException(f"{api} 超过总时限")
+
+
+async def request(method, url, **kwargs):
+    """向上游发送请求，自动套用该接口的超时、重试和熔断策略并记录指标"""
+    api = endpoint_name(url)
+    kwargs.setdefault("timeout", endpoint_timeout(api))
+
+    breaker = get_breaker(api)
+    if not breaker.allow():
+        metrics.UPSTREAM_CIRCUIT_REJECTED.inc(api)
+        raise CircuitOpenError("丰巢接口暂时不可用，请稍后重试")
+
+    if api in IDEMPOTENT_ENDPOINTS:
+        return await _request_with_retry(method, url, api, breaker, **kwargs)
+    return await _request_once(method, url, api, breaker, **kwargs)
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+def decode_json(response):
+    """解析上游响应的JSON，并计入 json_decode 阶段耗时"""
+    with metrics.phase("json_decode"):
+        return fast_json.loads(response.content)
+
+
+class UpstreamError(Exception):
+    """上游请求失败或返回了无法使用的数据，消息内容可直接返回给前端"""
+
+
+class CircuitOpenError(UpstreamError):
+    """接口处于熔断状态，请求没有发出"""
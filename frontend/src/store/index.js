@@ -4,7 +4,6 @@ import axios from 'axios'
 export default createStore({
   state: {
     phoneNumber: '',
-    verificationParams: null,
     authorization: localStorage.getItem('authorization') || '',
     userId: localStorage.getItem('userId') || '',
     completedOrders: [],
@@ -16,9 +15,6 @@ export default createStore({
     SET_PHONE_NUMBER(state, phoneNumber) {
       state.phoneNumber = phoneNumber
     },
-    SET_VERIFICATION_PARAMS(state, params) {
-      state.verificationParams = params
-    },
     SET_AUTH(state, { authorization, userId }) {
       state.authorization = authorization
       state.userId = userId
@@ -69,7 +65,6 @@ export default createStore({
 
         if (response.data.success) {
           commit('SET_PHONE_NUMBER', phoneNumber)
-          commit('SET_VERIFICATION_PARAMS', response.data.params)
           return { success: true, data: response.data }
         }
 
@@ -82,17 +77,13 @@ export default createStore({
 
     async login({ commit, state }, verificationCode) {
       try {
-        if (!state.verificationParams) {
+        if (!state.phoneNumber) {
           return { success: false, error: '验证参数丢失，请重新获取验证码' }
         }
 
         const response = await axios.post('/login', {
           phoneNumber: state.phoneNumber,
-          verificationCode,
-          rsaPublicKey: state.verificationParams.rsa_public_key,
-          clientIp: state.verificationParams.client_ip,
-          requestCode: state.verificationParams.request_code,
-          timestamp: state.verificationParams.timestamp
+          verificationCode
         })
 
         if (response.data.success) {
@@ -162,7 +153,7 @@ export default createStore({
       }
     },
 
-    async fetchPendingOrders({ commit, state }, { page = 1, reset = false } = {}) {
+    async fetchPendingOrders({ commit, state }, { page = 1, reset = false, refresh = false } = {}) {
       try {
         const response = await axios.get('/pending_orders', {
           headers: {
@@ -170,7 +161,8 @@ export default createStore({
           },
           params: {
             page,
-            limit: 10 // 每页10条
+            limit: 10, // 每页10条
+            refresh // 为true时后端跳过缓存重新拉取
           }
         });
 
@@ -1,10 +1,42 @@
 import { defineConfig } from 'vite'
 import vue from '@vitejs/plugin-vue'
-import { resolve } from 'path'
+import { resolve, join, extname } from 'path'
+import { readdirSync, readFileSync, statSync, writeFileSync } from 'fs'
+import { brotliCompressSync, gzipSync, constants as zlibConstants } from 'zlib'
+
+// 构建完成后为文本类文件生成 .br 和 .gz，后端托管时按 Accept-Encoding 直接返回
+const COMPRESSIBLE = new Set(['.html', '.js', '.css', '.svg', '.json', '.txt', '.map'])
+const MIN_COMPRESS_SIZE = 1024
+
+function precompress() {
+  let outDir = 'dist'
+  const walk = (dir) => readdirSync(dir).flatMap((name) => {
+    const path = join(dir, name)
+    return statSync(path).isDirectory() ? walk(path) : [path]
+  })
+  return {
+    name: 'precompress',
+    apply: 'build',
+    configResolved(config) {
+      outDir = resolve(config.root, config.build.outDir)
+    },
+    closeBundle() {
+      for (const file of walk(outDir)) {
+        if (!COMPRESSIBLE.has(extname(file))) continue
+        const content = readFileSync(file)
+        if (content.length < MIN_COMPRESS_SIZE) continue
+        writeFileSync(`${file}.br`, brotliCompressSync(content, {
+          params: { [zlibConstants.BROTLI_PARAM_QUALITY]: zlibConstants.BROTLI_MAX_QUALITY }
+        }))
+        writeFileSync(`${file}.gz`, gzipSync(content, { level: 9 }))
+      }
+    }
+  }
+}
 
 // https://vitejs.dev/config/
 export default defineConfig({
-  plugins: [vue()],
+  plugins: [vue(), precompress()],
   resolve: {
     alias: {
       '@': resolve(__dirname, 'src')